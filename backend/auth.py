@@ -1,3 +1,5 @@
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -8,29 +10,58 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from models import User, TokenData
 from database import get_users_collection
+from executors import hash_pool
 
 load_dotenv()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+# Resolved users kept per token subject, so protected endpoints do not query Mongo on every request.
+# Changes made by another process are picked up when the entry expires.
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 1024))
+# Build the user from the token's own claims, without any lookup, while the token is this fresh
+TRUST_TOKEN_CLAIMS = os.getenv("TRUST_TOKEN_CLAIMS", "false").lower() in ("1", "true", "yes")
+TOKEN_CLAIMS_FRESH_SECONDS = int(os.getenv("TOKEN_CLAIMS_FRESH_SECONDS", 120))
 
 pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# email -> (monotonic expiry, User); most recently used last
+_principals = OrderedDict()
+# email -> wall-clock time the user was last changed; tokens issued before that are not trusted
+_changed = {}
+
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
 
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def needs_rehash(hashed_password):
+    """True when the hash uses an outdated scheme or fewer rounds than pwd_context now asks for."""
+    try:
+        return pwd_context.needs_update(hashed_password)
+    except ValueError:
+        # Not a hash pwd_context recognizes (e.g. left over from an older scheme)
+        return True
+
+async def check_password(plain_password, hashed_password):
+    """verify_password in the bounded hash pool, off the event loop."""
+    return await hash_pool.run(verify_password, plain_password, hashed_password)
+
+async def hash_password(password):
+    """get_password_hash in the bounded hash pool, off the event loop."""
+    return await hash_pool.run(get_password_hash, password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -45,7 +76,7 @@ async def authenticate_user(email: str, password: str):
     if not password_hash:
         return False
 
-    if not verify_password(password, password_hash):
+    if not await check_password(password, password_hash):
         return False
 
     # Convert ObjectId to string for Pydantic
@@ -54,6 +85,50 @@ async def authenticate_user(email: str, password: str):
     user.pop("_id", None)
     return User(**user)
 
+def _cached_principal(email: str) -> Optional[User]:
+    entry = _principals.get(email)
+    if entry is None:
+        return None
+    if entry[0] <= time.monotonic():
+        del _principals[email]
+        return None
+    _principals.move_to_end(email)
+    return entry[1]
+
+def _cache_principal(email: str, user: User):
+    _principals[email] = (time.monotonic() + PRINCIPAL_CACHE_TTL_SECONDS, user)
+    _principals.move_to_end(email)
+    while len(_principals) > PRINCIPAL_CACHE_SIZE:
+        _principals.popitem(last=False)
+
+def invalidate_principal(email: str):
+    """Forget a cached user after its role, email or profile changed or it was deleted."""
+    _principals.pop(email, None)
+    now = time.time()
+    _changed[email] = now
+    for key in [k for k, t in _changed.items() if t < now - TOKEN_CLAIMS_FRESH_SECONDS]:
+        del _changed[key]
+
+def _principal_from_claims(payload: dict) -> Optional[User]:
+    """User built from a fresh token's claims, or None if it is too old, its user changed
+    since or it predates the created/updated claims."""
+    issued_at = payload.get("iat")
+    if issued_at is None or payload.get("uid") is None or time.time() - issued_at > TOKEN_CLAIMS_FRESH_SECONDS:
+        return None
+    if issued_at <= _changed.get(payload["sub"], 0):
+        return None
+    if payload.get("created") is None or payload.get("updated") is None:
+        return None
+    return User(
+        id=payload["uid"],
+        email=payload["sub"],
+        password_hash="",
+        full_name=payload.get("name") or "",
+        role=payload["role"],
+        created_at=payload["created"],
+        updated_at=payload["updated"],
+    )
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -69,16 +144,27 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(email=email, role=role)
     except JWTError:
         raise credentials_exception
-    
+
+    if TRUST_TOKEN_CLAIMS:
+        principal = _principal_from_claims(payload)
+        if principal is not None:
+            return principal
+    principal = _cached_principal(token_data.email)
+    if principal is not None:
+        return principal
+
     users_collection = await get_users_collection()
-    user = await users_collection.find_one({"email": token_data.email})
+    user = await users_collection.find_one({"email": token_data.email}, {"password_hash": 0, "password": 0})
     if user is None:
         raise credentials_exception
     # Convert ObjectId to string for Pydantic
     user["id"] = str(user["_id"])
     # Remove the original _id field to avoid conflicts
     user.pop("_id", None)
-    return User(**user)
+    # The hash is only needed to log in; do not keep it in memory for every request
+    principal = User(**user, password_hash="")
+    _cache_principal(token_data.email, principal)
+    return principal
 
 async def get_current_active_user(current_user: User = Depends(get_current_user)):
     if current_user.role == "pending":
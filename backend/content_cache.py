@@ -0,0 +1,108 @@
+import os
+import sys
+import hashlib
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional
+
+# Entries and total approximate bytes kept by each cache; least recently used go first
+CONTENT_CACHE_MAX_ENTRIES = int(os.getenv('CONTENT_CACHE_MAX_ENTRIES', 32))
+CONTENT_CACHE_MAX_MB = float(os.getenv('CONTENT_CACHE_MAX_MB', 256))
+
+
+def content_hash(contents: bytes) -> str:
+    return hashlib.sha256(contents).hexdigest()
+
+
+def render_key(source: str, template: Hashable, group_by: Optional[List[str]] = None, rows=None) -> tuple:
+    """rendered_results key for a template applied to the sheet identified by source."""
+    page = None if rows is None else content_hash(np.asarray(rows, dtype=np.int64).tobytes())
+    return (source, template, tuple(group_by or ()), page)
+
+
+def sizeof(value: Any) -> int:
+    """Approximate bytes held by a cached DataFrame or list of row dicts."""
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    if isinstance(value, list):
+        return sys.getsizeof(value) + sum(
+            sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values()) for row in value
+        )
+    return sys.getsizeof(value)
+
+
+class ContentCache:
+    """Bounded LRU cache keyed by content hashes, evicting by entry count and total size.
+
+    DataFrames are copied on the way in and out, so callers may modify them; other
+    values (row dict lists) are shared and must be treated as read-only.
+    """
+
+    def __init__(self, name: str, max_entries: int = CONTENT_CACHE_MAX_ENTRIES, max_bytes: Optional[int] = None):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = int(CONTENT_CACHE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self._entries = OrderedDict()  # key -> (value, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return _detached(entry[0])
+
+    def put(self, key: Hashable, value: Any, size: Optional[int] = None):
+        size = sizeof(value) if size is None else size
+        self.discard(key)
+        if size > self.max_bytes or self.max_entries <= 0:
+            # Larger than the whole cache: keeping it would only flush everything else
+            return
+        self._entries[key] = (_detached(value), size)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.bytes -= evicted
+            self.evictions += 1
+
+    def discard(self, key: Hashable):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'bytes': self.bytes,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+            'evictions': self.evictions,
+        }
+
+
+def _detached(value: Any) -> Any:
+    return value.copy() if isinstance(value, pd.DataFrame) else value
+
+
+# Parsed uploads: (content hash, file type) -> cleaned row dicts
+parsed_uploads = ContentCache('parsed_uploads')
+# Rendered templates: (dataset hash, template type/version, group_by, rows) -> DataFrame with Result
+rendered_results = ContentCache('rendered_results')
+
+
+def cache_stats() -> Dict[str, Dict[str, Any]]:
+    return {cache.name: cache.stats() for cache in (parsed_uploads, rendered_results)}
@@ -1,4 +1,6 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
 from dotenv import load_dotenv
 import os
 import ssl
@@ -8,12 +10,64 @@ load_dotenv()
 
 MONGODB_URL = os.getenv("MONGODB_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME")
+# "apply" creates missing indexes at startup, "check" only reports them, "off" skips both
+MONGO_INDEX_MODE = os.getenv("MONGO_INDEX_MODE", "apply").lower()
+
+# Indexes every collection should have, by the queries that use them
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),  # login, register, every authenticated request
+        IndexModel([("role", ASCENDING)]),  # /admin/users
+    ],
+    # /failed-sms pages newest first by (created_at, _id), per user or (admins) over everything
+    "failed_sms": [
+        IndexModel([("user_id", ASCENDING), ("resolved", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ],
+    "send_jobs": [
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),  # resuming unfinished jobs
+    ],
+    "send_job_items": [
+        IndexModel([("job_id", ASCENDING), ("status", ASCENDING), ("idx", ASCENDING)]),  # next pending chunk, results
+    ],
+    "sms_templates": [
+        IndexModel([("name", ASCENDING)]),
+    ],
+    "exams": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("created_at", DESCENDING)]),  # admins list every exam
+    ],
+    "exam_rows": [
+        IndexModel([("exam_id", ASCENDING), ("idx", ASCENDING)], unique=True),  # results in upload order, stale rows
+        IndexModel([("exam_id", ASCENDING), ("score", ASCENDING)]),  # rebuilding the score index
+    ],
+}
+
+# Representative (collection, filter, sort) lookups that check mode explains to catch collection scans
+INDEXED_QUERIES = [
+    ("users", {"email": "check@example.com"}, None),
+    ("users", {"role": "pending"}, None),
+    ("failed_sms", {"user_id": "check"}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("failed_sms", {"user_id": "check", "resolved": False}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("failed_sms", {}, [("created_at", DESCENDING), ("_id", DESCENDING)]),
+    ("send_jobs", {"status": {"$in": ["queued", "running"]}}, [("created_at", ASCENDING)]),
+    ("send_job_items", {"job_id": None, "status": "pending"}, [("idx", ASCENDING)]),
+    ("exams", {"user_id": "check"}, [("created_at", DESCENDING)]),
+    ("exam_rows", {"exam_id": None}, [("idx", ASCENDING)]),
+    ("exam_rows", {"exam_id": None, "score": {"$ne": None}}, None),
+]
 
 # Global variables
 client = None
 database = None
 users_collection = None
 failed_sms_collection = None
+send_jobs_collection = None
+send_job_items_collection = None
+sms_templates_collection = None
+exams_collection = None
+exam_rows_collection = None
 
 def get_mongodb_url():
     """Ensure MongoDB URL has proper SSL parameters for cloud deployment"""
@@ -47,7 +101,7 @@ def get_mongodb_url():
     return url
 
 async def init_database():
-    global client, database, users_collection, failed_sms_collection
+    global client, database, users_collection, failed_sms_collection, send_jobs_collection, send_job_items_collection, sms_templates_collection, exams_collection, exam_rows_collection
     if users_collection is not None:
         return users_collection
 
@@ -71,10 +125,23 @@ async def init_database():
         database = client[DATABASE_NAME]
         users_collection = database["users"]
         failed_sms_collection = database["failed_sms"]
+        send_jobs_collection = database["send_jobs"]
+        send_job_items_collection = database["send_job_items"]
+        sms_templates_collection = database["sms_templates"]
+        exams_collection = database["exams"]
+        exam_rows_collection = database["exam_rows"]
 
         # Test the connection
         await client.admin.command('ping')
         print("MongoDB Atlas connection successful")
+        if MONGO_INDEX_MODE == "apply":
+            await apply_indexes(database)
+        elif MONGO_INDEX_MODE == "check":
+            report = await check_indexes(database)
+            for name in report["missing"]:
+                print(f"Missing index: {name}")
+            for query in report["collection_scans"]:
+                print(f"Collection scan: {query}")
         return users_collection
 
     except Exception as e:
@@ -82,6 +149,47 @@ async def init_database():
         print("Please check your MongoDB Atlas cluster is running and accessible")
         raise e
 
+def _index_name(collection: str, index: IndexModel) -> str:
+    return f"{collection}.{index.document['name']}"
+
+
+async def apply_indexes(db):
+    """Create the INDEXES that are missing. Existing indexes are left as they are, so this is
+    safe on every start; an index that cannot be built (e.g. duplicate emails for a unique
+    index) is reported and skipped instead of failing startup."""
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                await db[collection].create_indexes([index])
+            except OperationFailure as e:
+                print(f"Could not create index {_index_name(collection, index)}: {e}")
+
+
+async def check_indexes(db):
+    """Report INDEXES missing from the database and INDEXED_QUERIES the server would answer
+    with a collection scan. Creates nothing."""
+    missing = []
+    for collection, indexes in INDEXES.items():
+        existing = {tuple(info["key"]) for info in (await db[collection].index_information()).values()}
+        for index in indexes:
+            if tuple(index.document["key"].items()) not in existing:
+                missing.append(_index_name(collection, index))
+
+    collection_scans = []
+    for collection, query, sort in INDEXED_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            plan = await cursor.explain()
+        except OperationFailure:
+            # The collection does not exist yet
+            continue
+        if "COLLSCAN" in str(plan.get("queryPlanner", {}).get("winningPlan")):
+            collection_scans.append(f"{collection} {query} sort={sort}")
+    return {"missing": missing, "collection_scans": collection_scans}
+
+
 async def get_users_collection():
     return await init_database()
 
@@ -90,4 +198,39 @@ async def get_failed_sms_collection():
     """Return the failed_sms collection, initializing DB if necessary."""
     await init_database()
     global failed_sms_collection
-    return failed_sms_collection
\ No newline at end of file
+    return failed_sms_collection
+
+
+async def get_send_jobs_collection():
+    """Return the send_jobs collection, initializing DB if necessary."""
+    await init_database()
+    global send_jobs_collection
+    return send_jobs_collection
+
+
+async def get_send_job_items_collection():
+    """Return the send_job_items collection, initializing DB if necessary."""
+    await init_database()
+    global send_job_items_collection
+    return send_job_items_collection
+
+
+async def get_sms_templates_collection():
+    """Return the sms_templates collection, initializing DB if necessary."""
+    await init_database()
+    global sms_templates_collection
+    return sms_templates_collection
+
+
+async def get_exams_collection():
+    """Return the exams collection, initializing DB if necessary."""
+    await init_database()
+    global exams_collection
+    return exams_collection
+
+
+async def get_exam_rows_collection():
+    """Return the exam_rows collection, initializing DB if necessary."""
+    await init_database()
+    global exam_rows_collection
+    return exam_rows_collection
\ No newline at end of file
@@ -0,0 +1,102 @@
+import os
+import uuid
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+DATASET_TTL_MINUTES = int(os.getenv('DATASET_TTL_MINUTES', 120))
+# Sheets kept per user: a user's uploads only ever push out that user's own oldest sheet
+DATASET_MAX_PER_USER = int(os.getenv('DATASET_MAX_PER_USER', 5))
+# Memory for all users together; past it the least recently used sheets go first
+DATASET_MAX_MB = float(os.getenv('DATASET_MAX_MB', 512))
+
+# dataset_id -> {'user_id', 'df', 'expires_at', 'content_hash', 'size'}; least recently used first
+_datasets = OrderedDict()
+
+
+def _compact(df: pd.DataFrame) -> pd.DataFrame:
+    """Store repetitive text columns (exam name, batch, messages...) as categoricals."""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype != object or not len(df):
+            continue
+        try:
+            if df[col].nunique(dropna=True) <= len(df) // 2:
+                df[col] = df[col].astype('category')
+        except TypeError:
+            # Unhashable cell values (lists/dicts) stay as they are
+            pass
+    return df
+
+
+def _expand(df: pd.DataFrame) -> pd.DataFrame:
+    """Undo _compact so callers get plain object columns back."""
+    cat_cols = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not cat_cols:
+        return df.copy()
+    return df.astype({c: object for c in cat_cols})
+
+
+def _evict(now: datetime, user_id: Optional[str] = None):
+    for dataset_id in [k for k, v in _datasets.items() if v['expires_at'] <= now]:
+        del _datasets[dataset_id]
+    if user_id is not None:
+        owned = [k for k, v in _datasets.items() if v['user_id'] == user_id]
+        for dataset_id in owned[:max(len(owned) - DATASET_MAX_PER_USER, 0)]:
+            del _datasets[dataset_id]
+    # Never evict the newest sheet, even if it alone is over the limit
+    while len(_datasets) > 1 and sum(v['size'] for v in _datasets.values()) > DATASET_MAX_MB * 1024 * 1024:
+        _datasets.popitem(last=False)
+
+
+def create_dataset(user_id: str, data, content_hash: Optional[str] = None) -> Dict[str, Any]:
+    """Keep an uploaded sheet server-side. `data` is a DataFrame or a list of row dicts;
+    content_hash identifies the uploaded file so results rendered from it can be cached.
+
+    Uploading the same file again returns the user's existing dataset (with a fresh expiry).
+    """
+    now = datetime.utcnow()
+    expires_at = now + timedelta(minutes=DATASET_TTL_MINUTES)
+    _evict(now)
+    if content_hash is not None:
+        for dataset_id, entry in _datasets.items():
+            if entry['user_id'] == user_id and entry['content_hash'] == content_hash:
+                entry['expires_at'] = expires_at
+                _datasets.move_to_end(dataset_id)
+                return {'dataset_id': dataset_id, 'expires_at': expires_at, 'rows': len(entry['df'])}
+
+    # Object columns keep cell values exactly as parsed (no int -> float upcasts)
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data, dtype=object)
+    dataset_id = uuid.uuid4().hex
+    compact = _compact(df)
+    _datasets[dataset_id] = {
+        'user_id': user_id,
+        'df': compact,
+        'expires_at': expires_at,
+        'content_hash': content_hash,
+        'size': int(compact.memory_usage(index=True, deep=True).sum()),
+    }
+    _evict(now, user_id)
+    return {'dataset_id': dataset_id, 'expires_at': expires_at, 'rows': len(df)}
+
+
+def get_dataset(dataset_id: str, user_id: str, rows: Optional[List[int]] = None) -> Optional[pd.DataFrame]:
+    """Return the dataset (optionally only the given row positions), or None if unknown, expired or not the user's."""
+    _evict(datetime.utcnow())
+    entry = _datasets.get(dataset_id)
+    if entry is None or entry['user_id'] != user_id:
+        return None
+    _datasets.move_to_end(dataset_id)
+    df = entry['df']
+    if rows is not None:
+        df = df.iloc[[i for i in rows if 0 <= i < len(df)]]
+    return _expand(df).reset_index(drop=True)
+
+
+def dataset_hash(dataset_id: str, user_id: str) -> Optional[str]:
+    """Content hash of the file a dataset was uploaded from, if known."""
+    entry = _datasets.get(dataset_id)
+    if entry is None or entry['user_id'] != user_id:
+        return None
+    return entry['content_hash']
@@ -0,0 +1,220 @@
+import asyncio
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from bson import ObjectId
+from pymongo import UpdateOne
+from database import get_exams_collection, get_exam_rows_collection
+from templates import LAYOUTS
+from sms_templates import get_template, compiled_for
+from executors import run_cpu
+
+# Columns the exam adds to a row; everything else is stored as uploaded
+_RANK_COLUMNS = ['Position', 'Result']
+
+
+class ScoreIndex:
+    """Sorted (ascending) scores of every ranked row of an exam.
+
+    Positions follow rank(ascending=False, method='min') over the whole cohort:
+    1 + the number of scores strictly greater. New batches are merged into the
+    sorted array instead of re-sorting everything already loaded.
+    """
+
+    def __init__(self, scores=(), rows: int = 0):
+        self.scores = np.sort(np.asarray(scores, dtype=float))
+        self.rows = rows  # rows (ranked or not) the index covers
+
+    def add(self, scores, rows: int):
+        new = np.sort(np.asarray(scores, dtype=float))
+        self.scores = np.insert(self.scores, np.searchsorted(self.scores, new), new)
+        self.rows += rows
+
+    def positions(self, scores) -> np.ndarray:
+        scores = np.asarray(scores, dtype=float)
+        return len(self.scores) - np.searchsorted(self.scores, scores, side='right') + 1
+
+    @property
+    def highest(self) -> int:
+        return int(self.scores[-1]) if len(self.scores) else 0
+
+
+# exam id -> ScoreIndex, rebuilt from Mongo when missing or behind
+_indexes = {}
+_locks = {}
+
+
+async def _renderer(exam: Dict[str, Any]):
+    """(score column, render(df, highest)) for the exam's layout or stored template."""
+    ttype = exam.get('type')
+    if ttype in LAYOUTS:
+        score_col, _, render = LAYOUTS[ttype]
+        return score_col, render
+    doc = await get_template(ttype) if ttype else None
+    if doc is None:
+        raise ValueError('unknown template type')
+    compiled = compiled_for(doc)
+    if not compiled.score_column:
+        raise ValueError('Template has no score column to rank by')
+    return compiled.score_column, compiled.render_ranked
+
+
+async def _load_index(exam: Dict[str, Any]) -> ScoreIndex:
+    key = str(exam['_id'])
+    index = _indexes.get(key)
+    if index is None or index.rows != exam.get('rows', 0):
+        # Another process added batches (or this one restarted): rebuild once from Mongo
+        exam_rows = await get_exam_rows_collection()
+        scores = [doc['score'] async for doc in exam_rows.find({'exam_id': exam['_id'], 'score': {'$ne': None}}, {'score': 1})]
+        index = _indexes[key] = ScoreIndex(scores, exam.get('rows', 0))
+    return index
+
+
+def _positions(index: ScoreIndex, scores: pd.Series) -> pd.Series:
+    ranked = scores.notna().to_numpy()
+    out = pd.Series(pd.NA, index=scores.index, dtype='Int64')
+    out[ranked] = index.positions(scores[ranked].to_numpy())
+    return out
+
+
+def _score_cells(scores: pd.Series) -> pd.Series:
+    """Scores as the renderers print them, the same in every batch: 85 not 85.0, None when missing."""
+    return pd.Series(
+        [None if np.isnan(s) else int(s) if s.is_integer() else s for s in scores.astype(float).tolist()],
+        index=scores.index, dtype=object,
+    )
+
+
+def _records(df: pd.DataFrame) -> List[Dict[str, Any]]:
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+async def create_exam(user_id: str, name: str, ttype: str) -> Dict[str, Any]:
+    """Create an empty exam ranked with a built-in layout or stored template. Raises ValueError for unknown types."""
+    now = datetime.utcnow()
+    exam = {'user_id': user_id, 'name': name, 'type': ttype, 'rows': 0, 'batches': 0, 'highest': 0, 'created_at': now, 'updated_at': now}
+    await _renderer(exam)
+    exams = await get_exams_collection()
+    result = await exams.insert_one(exam)
+    exam['_id'] = result.inserted_id
+    return _public(exam)
+
+
+async def get_exam(exam_id: str) -> Optional[Dict[str, Any]]:
+    if not ObjectId.is_valid(exam_id):
+        return None
+    exams = await get_exams_collection()
+    return await exams.find_one({'_id': ObjectId(exam_id)})
+
+
+async def list_exams(user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+    exams = await get_exams_collection()
+    query = {} if user_id is None else {'user_id': user_id}
+    return [_public(doc) async for doc in exams.find(query).sort('created_at', -1)]
+
+
+def _public(exam: Dict[str, Any]) -> Dict[str, Any]:
+    exam = dict(exam)
+    exam['exam_id'] = str(exam.pop('_id'))
+    return exam
+
+
+async def add_batch(exam: Dict[str, Any], df: pd.DataFrame, label: Optional[str] = None) -> Dict[str, Any]:
+    """Merge a batch of results (e.g. one center's sheet) into the exam ranking.
+
+    New rows are ranked against the whole cohort and rendered. Rows already stored
+    are re-rendered only when their position or the exam's highest mark changed:
+    all of them if the highest mark rose, otherwise only those scoring below the
+    batch's best score.
+    """
+    key = str(exam['_id'])
+    lock = _locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        exams = await get_exams_collection()
+        exam_rows = await get_exam_rows_collection()
+        exam = await exams.find_one({'_id': exam['_id']})
+        score_col, render = await _renderer(exam)
+        index = await _load_index(exam)
+
+        df = df.drop(columns=[c for c in _RANK_COLUMNS if c in df.columns]).reset_index(drop=True)
+        rows = _records(df)
+        if score_col in df.columns:
+            scores = pd.to_numeric(df[score_col], errors='coerce')
+        else:
+            scores = pd.Series(np.nan, index=df.index)
+        new_scores = scores.dropna().to_numpy()
+
+        old_highest = index.highest
+        start = exam.get('rows', 0)
+        index.add(new_scores, len(df))
+        highest = index.highest
+
+        df[score_col] = _score_cells(scores)
+        df['Position'] = _positions(index, scores)
+        df = await run_cpu(render, df, highest)
+
+        batch = exam.get('batches', 0)
+        if len(df):
+            await exam_rows.insert_many([
+                {
+                    'exam_id': exam['_id'],
+                    'idx': start + i,
+                    'batch': batch,
+                    'label': label,
+                    'row': row,
+                    'score': None if pd.isna(score) else float(score),
+                    'position': None if pd.isna(position) else int(position),
+                    'result': result,
+                }
+                for i, (row, score, position, result) in enumerate(zip(rows, scores, df['Position'], df['Result']))
+            ])
+
+        # Existing rows whose message changes
+        query = None
+        if highest != old_highest:
+            query = {'exam_id': exam['_id'], 'idx': {'$lt': start}}
+        elif len(new_scores):
+            query = {'exam_id': exam['_id'], 'idx': {'$lt': start}, 'score': {'$lt': float(new_scores.max())}}
+        rerendered = 0
+        if query is not None:
+            stale = await exam_rows.find(query, {'row': 1, 'score': 1}).sort('idx', 1).to_list(None)
+            if stale:
+                old = pd.DataFrame([doc['row'] for doc in stale])
+                old_scores = pd.Series([doc.get('score') for doc in stale], dtype=float)
+                old[score_col] = _score_cells(old_scores)
+                old['Position'] = _positions(index, old_scores)
+                old = await run_cpu(render, old, highest)
+                await exam_rows.bulk_write([
+                    UpdateOne(
+                        {'_id': doc['_id']},
+                        {'$set': {'position': None if pd.isna(position) else int(position), 'result': result}},
+                    )
+                    for doc, position, result in zip(stale, old['Position'], old['Result'])
+                ])
+                rerendered = len(stale)
+
+        await exams.update_one(
+            {'_id': exam['_id']},
+            {'$inc': {'rows': len(df), 'batches': 1}, '$set': {'highest': highest, 'updated_at': datetime.utcnow()}},
+        )
+        return {
+            'exam_id': key,
+            'batch': batch,
+            'added': len(df),
+            'rerendered': rerendered,
+            'rows': start + len(df),
+            'highest': highest,
+        }
+
+
+async def exam_results(exam: Dict[str, Any], offset: int = 0, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Stored rows of an exam in upload order with their current Position and Result."""
+    exam_rows = await get_exam_rows_collection()
+    cursor = exam_rows.find({'exam_id': exam['_id']}).sort('idx', 1).skip(offset)
+    if limit:
+        cursor = cursor.limit(limit)
+    out = []
+    async for doc in cursor:
+        out.append({**doc['row'], 'Position': doc.get('position'), 'Result': doc.get('result')})
+    return out
@@ -0,0 +1,135 @@
+import os
+import time
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Processes for heavy pandas parse/format/write work; 0 runs that work on the thread pool instead
+CPU_POOL_SIZE = int(os.getenv('CPU_POOL_SIZE', min(2, os.cpu_count() or 1)))
+# Threads for blocking I/O-ish work (temp files, small conversions)
+IO_POOL_SIZE = int(os.getenv('IO_POOL_SIZE', 8))
+# Password hashes computed or verified at once; further logins wait their turn
+HASH_POOL_SIZE = int(os.getenv('HASH_POOL_SIZE', 2))
+
+_process_pool = None
+_thread_pool = None
+
+
+class BoundedExecutor:
+    """Dedicated thread pool running at most `size` calls at once.
+
+    Callers wait for a slot on the event loop rather than in the pool's queue, so
+    the time spent waiting can be measured and reported by stats().
+    """
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = max(1, size)
+        self._pool = None
+        self._slots = None
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix=self.name)
+            self._slots = asyncio.Semaphore(self.size)
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.queued -= 1
+        waited = time.monotonic() - start
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        self.running += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, functools.partial(fn, *args, **kwargs))
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        started = self.completed + self.running
+        return {
+            'size': self.size,
+            'running': self.running,
+            'queued': self.queued,
+            'completed': self.completed,
+            'wait_avg_ms': round(1000 * self.wait_total / started, 1) if started else None,
+            'wait_max_ms': round(1000 * self.wait_max, 1),
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            self._slots = None
+
+
+# pbkdf2 releases the GIL, so threads hash in parallel without blocking the event loop
+hash_pool = BoundedExecutor('hash', HASH_POOL_SIZE)
+
+
+def _get_thread_pool() -> ThreadPoolExecutor:
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=max(1, IO_POOL_SIZE), thread_name_prefix='io')
+    return _thread_pool
+
+
+def _get_process_pool():
+    """Created on first use so startup does not pay for spawning workers."""
+    global _process_pool
+    if _process_pool is None and CPU_POOL_SIZE > 0:
+        # spawn, not fork: the parent runs an event loop and Mongo/HTTP client threads
+        _process_pool = ProcessPoolExecutor(max_workers=CPU_POOL_SIZE, mp_context=multiprocessing.get_context('spawn'))
+    return _process_pool
+
+
+def _drop_process_pool(pool):
+    """Forget a pool whose worker died so the next call starts a fresh one."""
+    global _process_pool
+    if _process_pool is pool:
+        _process_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Run a CPU-bound function (and its picklable arguments) in the process pool.
+
+    If a worker dies (e.g. killed for memory) the pool is broken for good: it is
+    replaced and the call retried once; a second failure raises BrokenProcessPool.
+    """
+    call = functools.partial(fn, *args, **kwargs)
+    for attempt in range(2):
+        pool = _get_process_pool() or _get_thread_pool()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(pool, call)
+        except BrokenProcessPool:
+            _drop_process_pool(pool)
+            if attempt:
+                raise
+
+
+async def run_io(fn, *args, **kwargs):
+    """Run a blocking I/O-ish function in the thread pool."""
+    return await asyncio.get_running_loop().run_in_executor(_get_thread_pool(), functools.partial(fn, *args, **kwargs))
+
+
+def stop_pools():
+    global _process_pool, _thread_pool
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=True, cancel_futures=True)
+        _process_pool = None
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=True, cancel_futures=True)
+        _thread_pool = None
+    hash_pool.shutdown()
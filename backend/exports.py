@@ -0,0 +1,195 @@
+import os
+import asyncio
+import tempfile
+import zipfile
+import pandas as pd
+from typing import AsyncIterator, Dict, Optional
+from fastapi.responses import StreamingResponse
+from executors import run_cpu, run_io
+
+XLSX_MEDIA_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 64 * 1024))
+# Zip entries: stored as-is when the format is already compressed (xlsx, parquet) or deflated at EXPORT_ZIP_LEVEL (0-9)
+EXPORT_ZIP_STORE = os.getenv('EXPORT_ZIP_STORE', 'true').lower() in ('1', 'true', 'yes')
+EXPORT_ZIP_LEVEL = int(os.getenv('EXPORT_ZIP_LEVEL', 6))
+
+# Rows converted to Python values at a time while writing
+_ROW_BATCH = 5000
+# Zip writes (about 8 KB each) buffered ahead of a slow client before the writer waits
+_ZIP_QUEUE_CHUNKS = 32
+
+# Same header look as DataFrame.to_excel
+_HEADER_FORMAT = {'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'}
+
+
+def write_xlsx(df: pd.DataFrame, target):
+    """Write df as a single-sheet workbook to a path or binary file object.
+
+    Uses xlsxwriter's constant_memory mode: each row is flushed to disk as soon as
+    it is written, so memory does not grow with the number of rows. Output matches
+    df.to_excel(index=False, engine='xlsxwriter'): bold header, blank cells for NaN.
+    """
+    from xlsxwriter import Workbook
+
+    workbook = Workbook(target, {'constant_memory': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+    try:
+        worksheet = workbook.add_worksheet()
+        header = workbook.add_format(_HEADER_FORMAT)
+        for col, name in enumerate(df.columns):
+            worksheet.write_string(0, col, str(name), header)
+
+        row = 1
+        for start in range(0, len(df), _ROW_BATCH):
+            chunk = df.iloc[start:start + _ROW_BATCH]
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for values in zip(*(chunk[c].tolist() for c in chunk.columns)):
+                for col, value in enumerate(values):
+                    if value is not None:
+                        worksheet.write(row, col, value)
+                row += 1
+    finally:
+        workbook.close()
+
+
+def write_csv(df: pd.DataFrame, target):
+    # BOM so Excel opens Bengali text as UTF-8
+    df.to_csv(target, index=False, encoding='utf-8-sig')
+
+
+def write_parquet(df: pd.DataFrame, target):
+    # Parquet columns need one type; mixed text/number columns (Roll, phones) are written as text
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].astype('string')
+    df.columns = [str(c) for c in df.columns]
+    df.to_parquet(target, index=False)
+
+
+# format -> (media type, writer, already compressed)
+EXPORT_FORMATS = {
+    'xlsx': (XLSX_MEDIA_TYPE, write_xlsx, True),
+    'csv': ('text/csv', write_csv, False),
+    'parquet': ('application/vnd.apache.parquet', write_parquet, True),
+}
+
+
+class _QueueWriter:
+    """Write-only, unseekable file for zipfile that hands every write to an asyncio queue.
+
+    Writes happen in worker threads; the bytes are passed to the event loop so the
+    response can send them while the rest of the archive is still being written.
+    The queue is bounded, so a writer waits for a slow client instead of buffering
+    the whole archive. Once closed (the client went away) writes are dropped.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, queue: asyncio.Queue):
+        self.loop = loop
+        self.queue = queue
+        self.closed = False
+
+    def write(self, data) -> int:
+        if not self.closed:
+            asyncio.run_coroutine_threadsafe(self.queue.put(bytes(data)), self.loop).result()
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+async def _zip_chunks(sheets: Dict[str, pd.DataFrame], write, store: bool, level: int) -> AsyncIterator[bytes]:
+    """Build every file in parallel in the CPU pool and stream them into a zip in
+    the order they finish. With store, entries are stored as they are: an .xlsx is
+    already a deflated zip, so compressing it again only costs time."""
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=_ZIP_QUEUE_CHUNKS)
+    writer = _QueueWriter(loop, queue)
+    compression = zipfile.ZIP_STORED if store else zipfile.ZIP_DEFLATED
+    zip_file = zipfile.ZipFile(writer, 'w', compression, compresslevel=None if store else level)
+
+    paths = {}
+    for name in sheets:
+        fd, paths[name] = tempfile.mkstemp(prefix='export-')
+        os.close(fd)
+
+    async def produce():
+        try:
+            building = {asyncio.ensure_future(run_cpu(write, df, paths[name])): name for name, df in sheets.items()}
+            while building:
+                done, _ = await asyncio.wait(building, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    name = building.pop(task)
+                    task.result()
+                    await run_io(zip_file.write, paths[name], name)
+            await run_io(zip_file.close)
+            await queue.put(None)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await queue.put(e)
+            raise
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        if not producer.done():
+            producer.cancel()
+        # A writer thread may be waiting on the full queue: free it and drop what it writes next
+        writer.closed = True
+        while not queue.empty():
+            queue.get_nowait()
+        await asyncio.gather(producer, return_exceptions=True)
+        for path in paths.values():
+            os.unlink(path)
+
+
+async def _built_file_chunks(build, *args) -> AsyncIterator[bytes]:
+    """Run build(*args, path) in the CPU pool, then yield the file in chunks and delete it."""
+    fd, path = tempfile.mkstemp(prefix='export-')
+    os.close(fd)
+    try:
+        await run_cpu(build, *args, path)
+        with open(path, 'rb') as f:
+            while True:
+                chunk = await run_io(f.read, EXPORT_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        os.unlink(path)
+
+
+def _download(chunks: AsyncIterator[bytes], media_type: str, filename: str) -> StreamingResponse:
+    return StreamingResponse(chunks, media_type=media_type, headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+
+def export_response(df: pd.DataFrame, basename: str, fmt: str = 'xlsx') -> StreamingResponse:
+    """Stream df as a `basename.fmt` download (fmt is a key of EXPORT_FORMATS).
+
+    The file is built on disk by the CPU pool when the response starts and sent
+    in EXPORT_CHUNK_SIZE pieces, so no full copy of it is held in memory and the
+    event loop stays free.
+    """
+    media_type, write, _ = EXPORT_FORMATS[fmt]
+    return _download(_built_file_chunks(write, df), media_type, f'{basename}.{fmt}')
+
+
+def export_zip_response(sheets: Dict[str, pd.DataFrame], filename: str, fmt: str = 'xlsx',
+                        store: Optional[bool] = None, level: Optional[int] = None) -> StreamingResponse:
+    """Stream a zip with one `basename.fmt` file per DataFrame (basename -> frame).
+
+    store and level default to EXPORT_ZIP_STORE and EXPORT_ZIP_LEVEL; formats that
+    are not compressed themselves (csv) are always deflated.
+    """
+    _, write, compressed = EXPORT_FORMATS[fmt]
+    store = (EXPORT_ZIP_STORE if store is None else store) and compressed
+    level = EXPORT_ZIP_LEVEL if level is None else level
+    entries = {f'{basename}.{fmt}': df for basename, df in sheets.items()}
+    return _download(_zip_chunks(entries, write, store, level), 'application/zip', filename)
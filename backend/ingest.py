@@ -0,0 +1,157 @@
+import io
+import json
+import pandas as pd
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+GUARDIAN_PHONE_COLUMN = 'Guardian Phone No'
+STUDENT_PHONE_COLUMN = 'Student Phone No'
+RESULT_COLUMN = 'Result'
+PHONE_COLUMNS = [GUARDIAN_PHONE_COLUMN, STUDENT_PHONE_COLUMN]
+
+
+def norm_header(h) -> str:
+    """Normalize a header name: replace NBSP, collapse whitespace, strip."""
+    if h is None:
+        return ''
+    s = str(h).replace('\u00A0', ' ')
+    s = ' '.join(s.split())
+    return s
+
+
+def map_columns(columns: List[str]) -> Tuple[Dict[str, str], bool]:
+    """Map common header variants to canonical column names.
+
+    Returns (rename_map, has_result); when no result/message column exists the
+    caller adds an empty 'Result' column so downstream flows can generate it.
+    """
+    guardian_col = None
+    student_col = None
+    result_col = None
+    for c in columns:
+        lc = c.lower()
+        # More flexible result column detection
+        if 'result' in lc or 'message' in lc or 'sms' in lc:
+            result_col = c
+        # More flexible guardian phone detection
+        if ('guardian' in lc or 'parent' in lc or 'father' in lc or 'mother' in lc) and ('phone' in lc or 'mobile' in lc or 'contact' in lc):
+            guardian_col = c
+        # More flexible student phone detection
+        if ('student' in lc or 'pupil' in lc) and ('phone' in lc or 'mobile' in lc or 'contact' in lc):
+            student_col = c
+
+    rename_map = {}
+    if guardian_col:
+        rename_map[guardian_col] = GUARDIAN_PHONE_COLUMN
+    if student_col:
+        rename_map[student_col] = STUDENT_PHONE_COLUMN
+    if result_col:
+        rename_map[result_col] = RESULT_COLUMN
+    return rename_map, result_col is not None
+
+
+def clean_value(key: str, value: Any) -> Any:
+    """JSON-friendly cell value: NaN -> None, whole floats and phone numbers -> str."""
+    if value is None or pd.isna(value):
+        return None
+    if isinstance(value, float) and value == int(value):
+        # Convert float phone numbers to strings (remove .0)
+        return str(int(value))
+    if key in PHONE_COLUMNS:
+        # Ensure phone numbers are strings
+        return str(value)
+    return value
+
+
+UPLOAD_EXTENSIONS = ('.xlsx', '.xls', '.csv', '.parquet')
+
+
+def read_frame(contents: bytes, filename: str = 'upload.xlsx') -> pd.DataFrame:
+    """Read an upload by extension: Excel, CSV (cells kept as text, as typed) or Parquet."""
+    name = filename.lower()
+    if name.endswith('.csv'):
+        # utf-8-sig also accepts files saved by Excel with a BOM
+        return pd.read_csv(io.BytesIO(contents), dtype=str, encoding='utf-8-sig')
+    if name.endswith('.parquet'):
+        return pd.read_parquet(io.BytesIO(contents))
+    return pd.read_excel(io.BytesIO(contents))
+
+
+def read_upload(contents: bytes, filename: str = 'upload.xlsx') -> List[Dict[str, Any]]:
+    """Parse a whole upload (Excel, CSV or Parquet) into cleaned row dicts."""
+    df = read_frame(contents, filename)
+    df.columns = [norm_header(c) for c in df.columns]
+    print('Columns found:', df.columns.tolist())
+
+    rename_map, has_result = map_columns(df.columns.tolist())
+    if not has_result:
+        print(f"Upload: 'Result' column missing, creating empty 'Result' column. Columns found: {df.columns.tolist()}")
+        df['Result'] = ''
+    if rename_map:
+        df = df.rename(columns=rename_map)
+
+    data = df.to_dict('records')
+    for row in data:
+        for key, value in row.items():
+            row[key] = clean_value(key, value)
+    print(f'Extracted {len(data)} rows')
+    return data
+
+
+def _unique_headers(raw: List[Any]) -> List[str]:
+    """Normalize headers the way pd.read_excel names them (Unnamed: i, duplicates as X.1)."""
+    headers = []
+    seen = {}
+    for i, h in enumerate(raw):
+        name = norm_header(h) if h is not None and str(h).strip() else f'Unnamed: {i}'
+        if name in seen:
+            seen[name] += 1
+            name = f'{name}.{seen[name]}'
+        else:
+            seen[name] = 0
+        headers.append(name)
+    return headers
+
+
+def ndjson_upload(fileobj, on_done: Optional[Callable[[List[Dict[str, Any]]], Dict[str, Any]]] = None) -> Iterator[bytes]:
+    """Stream an .xlsx upload as NDJSON using a read-only worksheet iterator.
+
+    Emits {"columns": [...]} first, then {"row": {...}} per non-empty row as it is
+    read, then {"done": true, "rows": n}. Header normalization and column mapping
+    run once, on the header row. When given, on_done receives all rows once the
+    sheet is read and whatever it returns is added to the done line.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        headers = _unique_headers(list(next(rows, None) or []))
+        rename_map, has_result = map_columns(headers)
+        columns = [rename_map.get(h, h) for h in headers]
+        if not has_result:
+            print(f"Upload: 'Result' column missing, creating empty 'Result' column. Columns found: {headers}")
+        yield _ndjson_line({'columns': columns if has_result else columns + [RESULT_COLUMN]})
+
+        count = 0
+        kept = [] if on_done else None
+        for values in rows:
+            if all(v is None for v in values):
+                continue
+            row = {key: clean_value(key, value) for key, value in zip(columns, values)}
+            if not has_result:
+                row[RESULT_COLUMN] = ''
+            count += 1
+            if kept is not None:
+                kept.append(row)
+            yield _ndjson_line({'row': row})
+    finally:
+        wb.close()
+    print(f'Streamed {count} rows')
+    done = {'done': True, 'rows': count}
+    if on_done:
+        done.update(on_done(kept))
+    yield _ndjson_line(done)
+
+
+def _ndjson_line(obj: Dict[str, Any]) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, default=str) + '\n').encode('utf-8')
@@ -0,0 +1,396 @@
+import os
+import uuid
+import socket
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Tuple
+from bson import ObjectId
+from pymongo import UpdateOne
+from database import get_send_jobs_collection, get_send_job_items_collection
+from sms_sender import send_personalized, normalize_phones
+
+SEND_JOB_WORKERS = int(os.getenv('SEND_JOB_WORKERS', 2))
+SEND_JOB_CHUNK_SIZE = int(os.getenv('SEND_JOB_CHUNK_SIZE', 200))
+# How long a claimed job stays owned by this process without a renewal, and how long
+# shutdown waits for chunks already sending before cancelling them
+SEND_JOB_LEASE_SECONDS = float(os.getenv('SEND_JOB_LEASE_SECONDS', 120))
+SEND_JOB_STOP_TIMEOUT = float(os.getenv('SEND_JOB_STOP_TIMEOUT', 30))
+
+# Owner recorded on the jobs this process claims
+INSTANCE_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+# In-process queue of job ids; the jobs themselves live in Mongo so they survive restarts
+_queue = None
+_workers = []
+_sweeper = None
+_stopping = None
+
+
+def _get_queue() -> asyncio.Queue:
+    global _queue
+    if _queue is None:
+        _queue = asyncio.Queue()
+    return _queue
+
+
+def _lease_until() -> datetime:
+    return datetime.utcnow() + timedelta(seconds=SEND_JOB_LEASE_SECONDS)
+
+
+def _resumable(now: datetime) -> Dict[str, Any]:
+    """Jobs nobody is working on: queued, or running under a lease that has expired."""
+    return {
+        'status': {'$in': ['queued', 'running']},
+        '$or': [{'status': 'queued'}, {'lease_until': {'$lt': now}}, {'lease_until': None}],
+    }
+
+
+async def create_job(user_id: str, kind: str, items: List[Dict[str, Any]]) -> str:
+    """Persist a send job and enqueue it. Returns the job id.
+
+    Each item is {'row': original row, 'message': sms text, 'phones': [raw numbers],
+    'normalized': [normalized numbers], 'valid': [sendable flags]}, as planned by
+    recipients.recipients_by_row.
+    """
+    jobs = await get_send_jobs_collection()
+    job_items = await get_send_job_items_collection()
+    # Items first, then the job already 'queued': a failure in between leaves no job
+    # stuck half-created, only orphan items, which are removed here
+    job_id = ObjectId()
+    try:
+        if items:
+            await job_items.insert_many([
+                {'job_id': job_id, 'idx': i, 'status': 'pending', **item} for i, item in enumerate(items)
+            ])
+        now = datetime.utcnow()
+        await jobs.insert_one({
+            '_id': job_id,
+            'user_id': user_id,
+            'kind': kind,
+            'status': 'queued',
+            'total': len(items),
+            'processed': 0,
+            'sent_count': 0,
+            'failed_count': 0,
+            'saved_count': 0,
+            'created_at': now,
+            'updated_at': now,
+        })
+    except Exception:
+        await job_items.delete_many({'job_id': job_id})
+        raise
+    _get_queue().put_nowait(job_id)
+    return str(job_id)
+
+
+async def _send_chunk(chunk: List[Dict[str, Any]], seen: Dict[Tuple[str, str], Tuple[bool, Any]]) -> Tuple[List[Dict[str, Any]], int]:
+    """Send every (phone, message) pair of a chunk in batched many-to-many requests.
+
+    `seen` maps (normalized number, message) to the outcome of a send made earlier in
+    the job; such pairs are not sent again and reuse that outcome. Returns one outcome
+    per item (a row succeeds if any of its phones was sent) and the number of sends saved.
+    """
+    pairs = []
+    owners = []
+    normalized = []
+    valid = []
+    for pos, item in enumerate(chunk):
+        message = item.get('message')
+        phones = item.get('phones') or []
+        if not message or not phones:
+            continue
+        if item.get('normalized') is None:
+            # Items queued before numbers were planned up front
+            norm, ok = normalize_phones(phones)
+            item['normalized'], item['valid'] = norm.tolist(), ok.tolist()
+        pairs.extend((phone, str(message)) for phone in phones)
+        owners.extend([pos] * len(phones))
+        normalized.extend(item['normalized'])
+        valid.extend(item['valid'])
+
+    entries = [[] for _ in chunk]
+    sent = [0] * len(chunk)
+    saved = 0
+
+    def record(i, entry):
+        entries[owners[i]].append(entry)
+        if entry['ok']:
+            sent[owners[i]] += 1
+
+    to_send = []
+    to_send_pos = []
+    for i, ((phone, message), norm, is_valid) in enumerate(zip(pairs, normalized, valid)):
+        if is_valid and (norm, message) in seen:
+            ok, info = seen[(norm, message)]
+            record(i, {'number': phone, 'normalized': norm, 'info': info, 'ok': ok, 'duplicate': True})
+            saved += 1
+        else:
+            to_send.append((phone, message))
+            to_send_pos.append(i)
+
+    if to_send:
+        res = await send_personalized(
+            to_send,
+            normalized=[normalized[i] for i in to_send_pos],
+            valid=[valid[i] for i in to_send_pos],
+        )
+        saved += res.get('duplicates_skipped', 0)
+        for ok, key in ((True, 'successful_recipients'), (False, 'failed_recipients')):
+            for entry in res.get(key, []):
+                i = to_send_pos[entry.pop('index')]
+                if entry.pop('duplicate_of', None) is not None:
+                    entry['duplicate'] = True
+                elif 'reason' not in entry:
+                    seen[(entry['normalized'], pairs[i][1])] = (ok, entry.get('info'))
+                entry['ok'] = ok
+                record(i, entry)
+
+    outcomes = []
+    for pos, item in enumerate(chunk):
+        if not item.get('message'):
+            info = 'no_message'
+        elif not item.get('phones'):
+            info = 'no_phone'
+        else:
+            info = entries[pos]
+        outcomes.append({'status': 'sent' if sent[pos] else 'failed', 'sent': sent[pos], 'info': info})
+    return outcomes, saved
+
+
+async def _load_seen(job_id: ObjectId) -> Dict[Tuple[str, str], Tuple[bool, Any]]:
+    """Rebuild the sent-pair index of a resumed job from its processed items."""
+    job_items = await get_send_job_items_collection()
+    seen = {}
+    async for item in job_items.find({'job_id': job_id, 'status': {'$in': ['sent', 'failed']}}, {'message': 1, 'info': 1}):
+        if not isinstance(item.get('info'), list):
+            continue
+        for entry in item['info']:
+            if 'reason' not in entry and not entry.get('duplicate'):
+                seen[(entry.get('normalized'), str(item.get('message')))] = (entry.get('ok', False), entry.get('info'))
+    return seen
+
+
+async def _fail_interrupted(job_id: ObjectId):
+    """Settle items a previous owner was still sending when it stopped.
+
+    Whether the provider delivered them is unknown, so they are reported as failed
+    rather than sent a second time.
+    """
+    jobs = await get_send_jobs_collection()
+    job_items = await get_send_job_items_collection()
+    result = await job_items.update_many(
+        {'job_id': job_id, 'status': 'sending'},
+        {'$set': {'status': 'failed', 'sent': 0, 'info': 'interrupted'}},
+    )
+    if result.modified_count:
+        await jobs.update_one(
+            {'_id': job_id},
+            {
+                '$inc': {'processed': result.modified_count, 'failed_count': result.modified_count},
+                '$set': {'updated_at': datetime.utcnow()},
+            },
+        )
+
+
+async def _hold_lease(job_id: ObjectId, lost: asyncio.Event):
+    """Renew the lease on a claimed job until cancelled; sets `lost` if another owner took it."""
+    jobs = await get_send_jobs_collection()
+    while True:
+        await asyncio.sleep(SEND_JOB_LEASE_SECONDS / 3)
+        result = await jobs.update_one(
+            {'_id': job_id, 'owner': INSTANCE_ID, 'status': 'running'},
+            {'$set': {'lease_until': _lease_until()}},
+        )
+        if not result.matched_count:
+            lost.set()
+            return
+
+
+async def run_job(job_id: ObjectId):
+    """Claim a job and drain its pending items chunk by chunk, updating counters as it goes.
+
+    The claim is atomic, so a job is worked on by one process at a time; a running job
+    is only taken over once its owner's lease has expired. Items are marked 'sending'
+    before they go to the provider; on shutdown the chunk in flight is allowed to finish.
+    """
+    jobs = await get_send_jobs_collection()
+    job_items = await get_send_job_items_collection()
+
+    if _stopping is not None and _stopping.is_set():
+        return
+    now = datetime.utcnow()
+    job = await jobs.find_one_and_update(
+        {'_id': job_id, **_resumable(now)},
+        {'$set': {'status': 'running', 'owner': INSTANCE_ID, 'lease_until': _lease_until(), 'updated_at': now}},
+    )
+    if not job:
+        return
+
+    await _fail_interrupted(job_id)
+    # Identical (number, message) pairs across the whole job are sent once
+    seen = await _load_seen(job_id) if job.get('processed') else {}
+
+    lost = asyncio.Event()
+    lease = asyncio.create_task(_hold_lease(job_id, lost))
+    try:
+        while True:
+            if lost.is_set():
+                return
+            if _stopping is not None and _stopping.is_set():
+                # Hand the job over at once rather than after the lease runs out
+                await jobs.update_one(
+                    {'_id': job_id, 'owner': INSTANCE_ID},
+                    {'$set': {'lease_until': datetime.utcnow(), 'updated_at': datetime.utcnow()}},
+                )
+                return
+
+            chunk = await job_items.find({'job_id': job_id, 'status': 'pending'}).sort('idx', 1).limit(SEND_JOB_CHUNK_SIZE).to_list(SEND_JOB_CHUNK_SIZE)
+            if not chunk:
+                break
+            await job_items.update_many(
+                {'_id': {'$in': [item['_id'] for item in chunk]}, 'status': 'pending'},
+                {'$set': {'status': 'sending'}},
+            )
+
+            outcomes, saved = await _send_chunk(chunk, seen)
+
+            # Only items still 'sending': a new owner may have settled them if the lease was lost
+            await job_items.bulk_write([
+                UpdateOne(
+                    {'_id': item['_id'], 'status': 'sending'},
+                    {'$set': {'status': o['status'], 'sent': o['sent'], 'info': o['info']}},
+                )
+                for item, o in zip(chunk, outcomes)
+            ])
+            await jobs.update_one(
+                {'_id': job_id},
+                {
+                    '$inc': {
+                        'processed': len(chunk),
+                        'sent_count': sum(o['sent'] for o in outcomes),
+                        'failed_count': sum(1 for o in outcomes if o['status'] == 'failed'),
+                        'saved_count': saved,
+                    },
+                    '$set': {'updated_at': datetime.utcnow()},
+                },
+            )
+    finally:
+        lease.cancel()
+
+    await jobs.update_one(
+        {'_id': job_id, 'owner': INSTANCE_ID},
+        {'$set': {'status': 'completed', 'updated_at': datetime.utcnow(), 'finished_at': datetime.utcnow()}},
+    )
+
+
+async def _worker(n: int):
+    queue = _get_queue()
+    while True:
+        job_id = await queue.get()
+        try:
+            if job_id is None:
+                return
+            await run_job(job_id)
+        except Exception as e:
+            print(f'Send job {job_id} failed in worker {n}: {e}')
+            try:
+                jobs = await get_send_jobs_collection()
+                await jobs.update_one(
+                    {'_id': job_id},
+                    {'$set': {'status': 'failed', 'error': str(e), 'updated_at': datetime.utcnow()}},
+                )
+            except Exception:
+                pass
+        finally:
+            queue.task_done()
+
+
+async def _enqueue_resumable():
+    jobs = await get_send_jobs_collection()
+    async for job in jobs.find(_resumable(datetime.utcnow()), {'_id': 1}).sort('created_at', 1):
+        _get_queue().put_nowait(job['_id'])
+
+
+async def _sweep():
+    """Pick up jobs whose owner stopped renewing its lease (crashed or killed instances)."""
+    jobs = await get_send_jobs_collection()
+    while True:
+        await asyncio.sleep(SEND_JOB_LEASE_SECONDS)
+        try:
+            async for job in jobs.find({'status': 'running', 'lease_until': {'$lt': datetime.utcnow()}}, {'_id': 1}):
+                _get_queue().put_nowait(job['_id'])
+        except Exception as e:
+            print(f'Send job sweep failed: {e}')
+
+
+async def start_workers():
+    """Start the worker pool and re-enqueue jobs nobody else is working on."""
+    global _stopping, _sweeper
+    if _workers:
+        return
+    _stopping = asyncio.Event()
+    await _enqueue_resumable()
+    for n in range(max(1, SEND_JOB_WORKERS)):
+        _workers.append(asyncio.create_task(_worker(n)))
+    _sweeper = asyncio.create_task(_sweep())
+
+
+async def stop_workers():
+    """Stop taking chunks, give chunks already sending SEND_JOB_STOP_TIMEOUT to finish, then cancel."""
+    global _sweeper
+    if not _workers:
+        return
+    _stopping.set()
+    _sweeper.cancel()
+    for _ in _workers:
+        _get_queue().put_nowait(None)
+    _, pending = await asyncio.wait(_workers, timeout=SEND_JOB_STOP_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    await asyncio.gather(_sweeper, *_workers, return_exceptions=True)
+    _workers.clear()
+    _sweeper = None
+
+
+async def get_job(job_id: str, include_recipients: bool = False) -> Optional[Dict[str, Any]]:
+    """Return the progress of a job, or None if the id is unknown."""
+    if not ObjectId.is_valid(job_id):
+        return None
+    jobs = await get_send_jobs_collection()
+    job = await jobs.find_one({'_id': ObjectId(job_id)})
+    if not job:
+        return None
+
+    pending = job.get('total', 0) - job.get('processed', 0)
+    out = {
+        'job_id': str(job['_id']),
+        'user_id': job.get('user_id'),
+        'kind': job.get('kind'),
+        'status': job.get('status'),
+        'total': job.get('total', 0),
+        'sent_count': job.get('sent_count', 0),
+        'failed_count': job.get('failed_count', 0),
+        'saved_count': job.get('saved_count', 0),
+        'pending': pending,
+        'created_at': job.get('created_at'),
+        'updated_at': job.get('updated_at'),
+        'message': (
+            f"SMS sent to {job.get('sent_count', 0)} numbers. Failed: {job.get('failed_count', 0)}. "
+            f"Pending: {pending}. Duplicate sends saved: {job.get('saved_count', 0)}"
+        ),
+    }
+    if job.get('error'):
+        out['error'] = job['error']
+
+    if include_recipients:
+        job_items = await get_send_job_items_collection()
+        successful_recipients = []
+        failed_recipients = []
+        async for item in job_items.find({'job_id': job['_id'], 'status': {'$in': ['sent', 'failed']}}, {'row': 1, 'status': 1}).sort('idx', 1):
+            if item['status'] == 'sent':
+                successful_recipients.append(item.get('row'))
+            else:
+                failed_recipients.append(item.get('row'))
+        out['successful_recipients'] = successful_recipients
+        out['failed_recipients'] = failed_recipients
+    return out
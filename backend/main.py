@@ -1,21 +1,27 @@
+from __future__ import annotations
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from contextlib import asynccontextmanager
-import pandas as pd
-import io
+import anyio
+from typing import TYPE_CHECKING, Optional
 import os
 from dotenv import load_dotenv
-import requests
 from datetime import timedelta, datetime
-from models import User, UserCreate, UserLogin, UserUpdate, Token, UserRole, UserResponse
-from auth import authenticate_user, create_access_token, get_current_user, get_current_active_user, get_current_admin_user, get_password_hash
+from models import User, UserCreate, UserLogin, UserUpdate, Token, UserRole, UserResponse, SmsTemplateCreate, SmsTemplateUpdate
+from auth import authenticate_user, create_access_token, get_current_user, get_current_active_user, get_current_admin_user, hash_password, check_password, needs_rehash, invalidate_principal
 from database import init_database, get_users_collection, get_failed_sms_collection
-from sms_sender import bulk_send, normalize_phone
-from templates import format_varsity_results, format_medical_results
-import pandas as pd
+from sms_sender import bulk_send, normalize_phone, open_client, close_client, get_client
+from jobs import create_job, get_job, start_workers, stop_workers
+from executors import run_cpu, run_io, stop_pools, hash_pool
 from io import BytesIO
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, JSONResponse
+from concurrent.futures.process import BrokenProcessPool
+
+# pandas (and the sheet modules built on it) is imported by the endpoints that use it,
+# so a cold start only pays for what health checks and sign-in need
+if TYPE_CHECKING:
+    import pandas as pd
 
 load_dotenv()
 
@@ -23,6 +29,8 @@ load_dotenv()
 async def lifespan(app: FastAPI):
     # Startup
     await init_database()
+    await open_client()
+    await start_workers()
 
     # Create admin user if not exists
     users_collection = await get_users_collection()
@@ -32,16 +40,18 @@ async def lifespan(app: FastAPI):
 
     existing_admin = await users_collection.find_one({'email': admin_email})
     if existing_admin:
-        # Update admin password to new hash scheme
-        await users_collection.update_one(
-            {'email': admin_email},
-            {'$set': {'password_hash': get_password_hash(admin_password), 'updated_at': datetime.utcnow()}}
-        )
-        print('Admin user updated')
+        # Rehash only when ADMIN_PASSWORD changed or the stored hash uses an old scheme
+        stored_hash = existing_admin.get('password_hash')
+        if not stored_hash or needs_rehash(stored_hash) or not await check_password(admin_password, stored_hash):
+            await users_collection.update_one(
+                {'email': admin_email},
+                {'$set': {'password_hash': await hash_password(admin_password), 'updated_at': datetime.utcnow()}}
+            )
+            print('Admin user updated')
     else:
         admin_user = {
             'email': admin_email,
-            'password_hash': get_password_hash(admin_password),
+            'password_hash': await hash_password(admin_password),
             'full_name': admin_full_name,
             'role': 'admin',
             'created_at': datetime.utcnow(),
@@ -52,11 +62,19 @@ async def lifespan(app: FastAPI):
 
     yield
 
-    # Shutdown (if needed)
-    pass
+    # Shutdown
+    await stop_workers()
+    await close_client()
+    stop_pools()
 
 app = FastAPI(lifespan=lifespan)
 
+@app.exception_handler(BrokenProcessPool)
+async def worker_pool_failed(request, exc):
+    # run_cpu already replaced the pool and retried once; a fresh pool failing again
+    # is most likely this request's own input (e.g. a sheet too large to parse)
+    return JSONResponse(status_code=503, content={'detail': 'Worker process failed, please try again'})
+
 # Allow CORS
 # Robust CORS origins parsing: include common localhost variants by default for local dev
 cors_env = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://127.0.0.1:3000')
@@ -81,6 +99,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 30))
 
+# /failed-sms: largest page, fields the page shows, and how far a filtered count goes before giving up
+FAILED_SMS_MAX_LIMIT = 200
+FAILED_SMS_FIELDS = {'original_number': 1, 'normalized': 1, 'message': 1, 'created_at': 1, 'resolved': 1}
+FAILED_SMS_COUNT_LIMIT = 10000
+# /exams/{exam_id}: largest page of ranked rows
+EXAM_RESULTS_MAX_LIMIT = 500
+
 @app.get('/healthz')
 async def health_check():
     """Health check endpoint for Render"""
@@ -105,7 +130,7 @@ async def register(user: UserCreate):
     # Create new user with pending role
     user_dict = {
         'email': user.email,
-        'password_hash': get_password_hash(user.password),
+        'password_hash': await hash_password(user.password),
         'full_name': user.full_name,
         'role': 'pending',
         'created_at': datetime.utcnow(),
@@ -132,7 +157,16 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={'sub': user.email, 'role': user.role.value}, expires_delta=access_token_expires
+        # uid, name and the timestamps let TRUST_TOKEN_CLAIMS build the user without a lookup
+        data={
+            'sub': user.email,
+            'role': user.role.value,
+            'uid': user.id,
+            'name': user.full_name,
+            'created': user.created_at.isoformat(),
+            'updated': user.updated_at.isoformat(),
+        },
+        expires_delta=access_token_expires
     )
     return {'access_token': access_token, 'token_type': 'bearer'}
 
@@ -166,7 +200,7 @@ async def update_user_me(user_update: UserUpdate, current_user: User = Depends(g
             raise HTTPException(status_code=400, detail='Email already taken')
         update_data['email'] = user_update.email
     if user_update.password:
-        update_data['password_hash'] = get_password_hash(user_update.password)
+        update_data['password_hash'] = await hash_password(user_update.password)
     if user_update.full_name:
         update_data['full_name'] = user_update.full_name
 
@@ -174,6 +208,7 @@ async def update_user_me(user_update: UserUpdate, current_user: User = Depends(g
         update_data['updated_at'] = datetime.utcnow()
         from bson import ObjectId
         await users_collection.update_one({'_id': ObjectId(current_user.id)}, {'$set': update_data})
+        invalidate_principal(current_user.email)
 
     return {'message': 'Profile updated successfully'}
 
@@ -194,12 +229,14 @@ async def approve_user(user_id: str, current_user: User = Depends(get_current_ad
     users_collection = await get_users_collection()
 
     from bson import ObjectId
-    result = await users_collection.update_one(
+    approved = await users_collection.find_one_and_update(
         {'_id': ObjectId(user_id), 'role': 'pending'},
-        {'$set': {'role': 'approved', 'updated_at': datetime.utcnow()}}
+        {'$set': {'role': 'approved', 'updated_at': datetime.utcnow()}},
+        projection={'email': 1},
     )
-    if result.modified_count == 0:
+    if approved is None:
         raise HTTPException(status_code=404, detail='User not found or already approved')
+    invalidate_principal(approved['email'])
     return {'message': 'User approved successfully'}
 
 @app.delete('/admin/user/{user_id}')
@@ -207,9 +244,10 @@ async def delete_user(user_id: str, current_user: User = Depends(get_current_adm
     users_collection = await get_users_collection()
 
     from bson import ObjectId
-    result = await users_collection.delete_one({'_id': ObjectId(user_id)})
-    if result.deleted_count == 0:
+    deleted = await users_collection.find_one_and_delete({'_id': ObjectId(user_id)}, projection={'email': 1})
+    if deleted is None:
         raise HTTPException(status_code=404, detail='User not found')
+    invalidate_principal(deleted['email'])
     return {'message': 'User deleted successfully'}
 
 @app.get('/admin/all-users', response_model=list[UserResponse])
@@ -224,94 +262,151 @@ async def get_all_users(current_user: User = Depends(get_current_admin_user)):
         users.append(UserResponse(**user_doc))
     return users
 
+@app.get('/admin/cache-stats')
+async def get_cache_stats(current_user: User = Depends(get_current_admin_user)):
+    """Entries, size and hit/miss counters of the parsed-upload and rendered-result caches."""
+    from content_cache import cache_stats
+    return cache_stats()
+
+@app.get('/admin/hash-stats')
+async def get_hash_stats(current_user: User = Depends(get_current_admin_user)):
+    """Password hashing pool: hashes running and waiting, completed count and slot wait times."""
+    return hash_pool.stats()
+
+def request_frame(request: dict, current_user: User, key: str = 'data') -> pd.DataFrame:
+    """Rows a request refers to: a stored dataset ({'dataset_id', 'rows'?}) or inline records under `key`."""
+    import pandas as pd
+    from datasets import get_dataset
+    dataset_id = request.get('dataset_id')
+    if dataset_id:
+        df = get_dataset(dataset_id, current_user.id, request.get('rows'))
+        if df is None:
+            raise HTTPException(status_code=404, detail='Dataset not found or expired')
+        return df
+    data = request.get(key)
+    if data is None:
+        raise HTTPException(status_code=400, detail=f'{key} required')
+    return pd.DataFrame(data)
+
+
+def request_source(request: dict, current_user: User):
+    """Content hash identifying the rows request_frame returns, or None for inline data."""
+    import numpy as np
+    from datasets import dataset_hash
+    from content_cache import content_hash
+    source = dataset_hash(request['dataset_id'], current_user.id) if request.get('dataset_id') else None
+    if source and request.get('rows') is not None:
+        source += ':' + content_hash(np.asarray(request['rows'], dtype=np.int64).tobytes())
+    return source
+
+
+def export_format(request: dict) -> str:
+    """Requested download format: 'xlsx' (default), 'csv' or 'parquet'."""
+    from exports import EXPORT_FORMATS
+    fmt = (request.get('format') or 'xlsx').lower()
+    if fmt not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+    return fmt
+
+
+def int_field(request: dict, key: str, minimum: Optional[int] = None) -> Optional[int]:
+    """An optional integer from a JSON body; 400 when it is not a whole number or below minimum."""
+    value = request.get(key)
+    if value is None:
+        return None
+    try:
+        if isinstance(value, bool):
+            raise ValueError
+        number = int(value)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=f'{key} must be an integer')
+    if minimum is not None and number < minimum:
+        raise HTTPException(status_code=400, detail=f'{key} must be at least {minimum}')
+    return number
+
+
+def zip_options(request: dict):
+    """(store, level) overrides for export zips, checked before the response starts streaming."""
+    store = request.get('store_xlsx')
+    level = request.get('compression_level')
+    if store is not None and not isinstance(store, bool):
+        raise HTTPException(status_code=400, detail='store_xlsx must be true or false')
+    if level is not None and (isinstance(level, bool) or not isinstance(level, int) or not 0 <= level <= 9):
+        raise HTTPException(status_code=400, detail='compression_level must be an integer from 0 to 9')
+    return store, level
+
+
+def frame_records(df: pd.DataFrame) -> list:
+    """Row dicts with NaN/NA replaced by None so they can be stored and returned as JSON."""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
 @app.post('/upload')
-async def upload_file(file: UploadFile = File(...), current_user: User = Depends(get_current_active_user)):
+async def upload_file(file: UploadFile = File(...), stream: bool = False, current_user: User = Depends(get_current_active_user)):
+    """Parse an Excel, CSV or Parquet upload and keep it server-side as a dataset. With
+    ?stream=true an .xlsx file is returned as NDJSON, one cleaned row per line, while it
+    is being read; the final line carries the dataset_id.
+
+    Parsed rows are cached by file content, so uploading the same file again skips parsing."""
+    from ingest import read_upload, ndjson_upload, UPLOAD_EXTENSIONS
+    from datasets import create_dataset
+    from content_cache import parsed_uploads, content_hash
+
     print('Received file upload request')
-    if not file.filename.endswith(('.xlsx', '.xls')):
-        raise HTTPException(status_code=400, detail='File must be Excel format')
+    if not file.filename.lower().endswith(UPLOAD_EXTENSIONS):
+        raise HTTPException(status_code=400, detail='File must be Excel, CSV or Parquet format')
 
     contents = await file.read()
-    df = pd.read_excel(io.BytesIO(contents))
-
-    # Normalize header names: replace NBSP, collapse whitespace, strip
-    def norm_header(h):
-        if h is None:
-            return ''
-        s = str(h).replace('\u00A0', ' ')
-        s = ' '.join(s.split())
-        return s
-
-    df.columns = [norm_header(c) for c in df.columns]
-    print('Columns found:', df.columns.tolist())
-
-    # Map common variants to canonical column names so downstream code can rely on them
-    guardian_col = None
-    student_col = None
-    result_col = None
-    for c in df.columns:
-        lc = c.lower()
-        # More flexible result column detection
-        if 'result' in lc or 'message' in lc or 'sms' in lc:
-            result_col = c
-        # More flexible guardian phone detection
-        if ('guardian' in lc or 'parent' in lc or 'father' in lc or 'mother' in lc) and ('phone' in lc or 'mobile' in lc or 'contact' in lc):
-            guardian_col = c
-        # More flexible student phone detection
-        if ('student' in lc or 'pupil' in lc) and ('phone' in lc or 'mobile' in lc or 'contact' in lc):
-            student_col = c
-
-    if result_col is None:
-        # If Result column is missing, create an empty 'Result' column so downstream flows can generate it
-        # Log for visibility and continue
-        print(f"Upload: 'Result' column missing, creating empty 'Result' column. Columns found: {df.columns.tolist()}")
-        df['Result'] = ''
-
-    # Rename detected columns to canonical names expected by frontend/backend
-    rename_map = {}
-    if guardian_col:
-        rename_map[guardian_col] = 'Guardian Phone No'
-    if student_col:
-        rename_map[student_col] = 'Student Phone No'
-    rename_map[result_col] = 'Result'
-
-    if rename_map:
-        df = df.rename(columns=rename_map)
-
-    data = df.to_dict('records')
-    # Replace NaN with None for JSON serialization and convert phone numbers to strings
-    for row in data:
-        for key, value in row.items():
-            if pd.isna(value):
-                row[key] = None
-            elif isinstance(value, float) and value == int(value):
-                # Convert float phone numbers to strings (remove .0)
-                row[key] = str(int(value))
-            elif key in ['Guardian Phone No', 'Student Phone No'] and value is not None:
-                # Ensure phone numbers are strings
-                row[key] = str(value)
-
-        print(f'Extracted {len(data)} rows')
-    return {'data': data}
+    digest = content_hash(contents)
+    # The same bytes parse differently as CSV and as Excel
+    key = (digest, os.path.splitext(file.filename.lower())[1])
+    if stream and file.filename.lower().endswith('.xlsx'):
+        # The upload is closed once this handler returns, so stream from the bytes already read
+        def store_on_loop(rows):
+            parsed_uploads.put(key, rows)
+            dataset = create_dataset(current_user.id, rows, digest)
+            return {'dataset_id': dataset['dataset_id'], 'expires_at': dataset['expires_at'].isoformat()}
+
+        def store(rows):
+            # The NDJSON iterator runs in a worker thread; the dataset store and cache are
+            # only ever touched from the event loop
+            return anyio.from_thread.run_sync(store_on_loop, rows)
+        return StreamingResponse(ndjson_upload(BytesIO(contents), on_done=store), media_type='application/x-ndjson')
+
+    data = parsed_uploads.get(key)
+    if data is None:
+        # Parsing a big sheet takes seconds; keep it off the event loop
+        try:
+            data = await run_cpu(read_upload, contents, file.filename)
+        except ImportError:
+            raise HTTPException(status_code=400, detail='Parquet support is not installed on the server')
+        parsed_uploads.put(key, data)
+    dataset = create_dataset(current_user.id, data, digest)
+    return {'data': data, 'dataset_id': dataset['dataset_id'], 'expires_at': dataset['expires_at']}
 
 @app.post('/send-sms')
 async def send_sms(request: dict, current_user: User = Depends(get_current_active_user)):
-    data = request.get('data', [])
-    selected_indices = request.get('selectedIndices', None)  # Optional: indices of selected rows
+    """Queue a background send job for the uploaded rows and return its id at once.
+    Poll /jobs/{job_id} for progress.
 
-    sent_count = 0
-    failed_count = 0
-    failed_recipients = []  # Track failed recipients
-    successful_recipients = []  # Track successful recipients
+    Accepts {'data': [...], 'selectedIndices'?: [...]} or {'dataset_id': ..., 'rows'?: [...]}."""
+    selected_indices = request.get('selectedIndices', None)  # Optional: indices of selected rows
 
     # BulkSMS BD API configuration
     api_key = os.getenv('SMS_API_KEY')
-    api_url = os.getenv('SMS_API_URL', 'http://bulksmsbd.net/api/smsapi')
-    sender_id = os.getenv('SMS_SENDER_ID', '8809617624071')
-    sms_dry_run = os.getenv('SMS_DRY_RUN', 'false').lower() in ('1', 'true', 'yes')
 
     if not api_key:
         return {'message': 'SMS API key not configured'}
 
+    if request.get('dataset_id'):
+        if request.get('rows') is None and selected_indices is not None:
+            request['rows'] = selected_indices
+        # The cached frame goes to the job as is, without a round trip through row dicts
+        df = request_frame(request, current_user)
+        print(f'Processing {len(df)} items for SMS')
+        return await queue_send_job(current_user, 'send-sms', frame=df)
+
+    data = request.get('data', [])
     print(f'send-sms called with {len(data)} items')
     if selected_indices:
         print(f'Selected indices: {selected_indices}')
@@ -324,179 +419,50 @@ async def send_sms(request: dict, current_user: User = Depends(get_current_activ
 
     print(f'Processing {len(filtered_data)} items for SMS')
 
-    # Send individual SMS to each phone number
-    for item in filtered_data:
-        sms_text = item.get('Result')
-        if not sms_text:
-            failed_count += 1
-            failed_recipients.append(item)
-            continue
-
-        # Get both student and guardian phone numbers
-        phones_to_send = []
-
-        # Look for guardian phone in various column names
-        guardian_phone = None
-        student_phone = None
-
-        phone_keys = ['Guardian Phone No', 'Guardian  Phone No', 'Guardian Phone', 'GuardianPhone']
-        for key in phone_keys:
-            if key in item and item.get(key) not in (None, '', 'nan'):
-                guardian_phone = str(item.get(key)).strip()
-                break
-
-        # Look for student phone
-        student_keys = ['Student Phone No', 'Student Phone']
-        for key in student_keys:
-            if key in item and item.get(key) not in (None, '', 'nan'):
-                student_phone = str(item.get(key)).strip()
-                break
-
-        # Add guardian phone if available
-        if guardian_phone and guardian_phone.lower() not in ('nan', 'none', ''):
-            phones_to_send.append(guardian_phone)
-
-        # Add student phone if available
-        if student_phone and student_phone.lower() not in ('nan', 'none', ''):
-            phones_to_send.append(student_phone)
-
-        # If no phones to send, mark as failed
-        if not phones_to_send:
-            failed_count += 1
-            failed_recipients.append(item)
-            continue
-
-        # Send individual SMS to each phone number
-        item_failed = True  # Assume failed until proven successful
-        valid_phones = []  # Track valid phones for this item
-        
-        for phone in phones_to_send:
-            print(f'Processing phone: {phone}')
-
-            # Normalize phone: remove spaces, dashes and parentheses
-            phone = phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-            # Remove any non-digit characters
-            phone = ''.join(ch for ch in phone if ch.isdigit())
-
-            # Normalize phone number format for Bangladesh
-            if phone.startswith('880'):
-                norm_phone = phone
-            elif phone.startswith('0'):
-                norm_phone = '880' + phone.lstrip('0')
-            elif len(phone) == 10:
-                norm_phone = '880' + phone
-            elif len(phone) == 11 and phone.startswith('1'):
-                norm_phone = '880' + phone
-            else:
-                norm_phone = phone
-
-            print(f'Normalized phone: {norm_phone}')
-
-            # Validate phone number length (must be at least 11 digits for Bangladesh)
-            if len(norm_phone) < 11:
-                print(f'Phone number too short: {norm_phone} (length: {len(norm_phone)})')
-                continue  # Skip this phone, try next one
-
-            valid_phones.append(norm_phone)
-
-            try:
-                # BulkSMS BD API format - individual SMS to each phone
-                payload = {
-                    'api_key': api_key,
-                    'senderid': sender_id,
-                    'number': norm_phone,
-                    'message': str(sms_text)
-                }
+    return await queue_send_job(current_user, 'send-sms', filtered_data)
 
-                if sms_dry_run:
-                    print('DRY RUN enabled - would POST to', api_url, 'with:')
-                    print(payload)
-                    sent_count += 1
-                    item_failed = False  # At least one phone succeeded
-                else:
-                    response = requests.post(api_url, data=payload, timeout=30)
-                    print(f'SMS API response status: {response.status_code}')
-                    print(f'Response body: {response.text}')
-
-                    if response.status_code == 200:
-                        try:
-                            result = response.text.strip()
-
-                            # Check if it's JSON response
-                            if result.startswith('{'):
-                                import json
-                                json_result = json.loads(result)
-
-                                # Check for IP whitelisting error
-                                if json_result.get('response_code') == 1032 or 'not Whitelisted' in str(json_result.get('error_message', '')):
-                                    print(f'IP Whitelisting error for {norm_phone}: {json_result.get('error_message')}')
-                                    continue
-
-                                # Check for success
-                                if json_result.get('response_code') == 1001 or 'success' in str(json_result.get('success_message', '')).lower():
-                                    sent_count += 1
-                                    item_failed = False  # At least one phone succeeded
-                                    print(f'SMS sent successfully to {norm_phone}')
-                                else:
-                                    print(f'Failed to send SMS to {norm_phone}: {json_result}')
-                            else:
-                                # Check BulkSMS BD text response format
-                                if result and 'success' in result.lower():
-                                    sent_count += 1
-                                    item_failed = False  # At least one phone succeeded
-                                    print(f'SMS sent successfully to {norm_phone}')
-                                elif result and any(code in result for code in ['1001', '200', '201']):
-                                    sent_count += 1
-                                    item_failed = False  # At least one phone succeeded
-                                    print(f'SMS sent successfully to {norm_phone}')
-                                else:
-                                    print(f'Failed to send SMS to {norm_phone}: {result}')
-                        except Exception as e:
-                            print(f'Error parsing response: {e}')
-                            # If we can't parse, check for common success indicators
-                            response_text = response.text.lower()
-                            if 'not whitelisted' in response_text:
-                                print(f'IP Whitelisting error for {norm_phone}')
-                            elif any(indicator in response_text for indicator in ['success', 'sent', 'ok', '1001']):
-                                sent_count += 1
-                                item_failed = False  # At least one phone succeeded
-                                print(f'SMS sent successfully to {norm_phone}')
-                            else:
-                                print(f'Failed to send SMS to {norm_phone}: {response.text}')
-                    else:
-                        print(f'API request failed with status {response.status_code}: {response.text}')
-
-            except Exception as e:
-                print(f'Error sending SMS to {norm_phone}: {e}')
-
-        # If no valid phones were found for this item, mark as failed
-        if not valid_phones:
-            failed_count += 1
-            failed_recipients.append(item)
-        # If all phones failed for this item, add to failed recipients
-        elif item_failed:
-            failed_count += 1
-            failed_recipients.append(item)
-        # If item was successful, add to successful recipients
-        else:
-            successful_recipients.append(item)
 
-    # Return response with recipients data
-    response_data = {
-        'message': f'SMS sent to {sent_count} numbers. Failed: {failed_count}',
-        'sent_count': sent_count,
-        'failed_count': failed_count
+def build_job_items(records: Optional[list], frame: Optional[pd.DataFrame]) -> tuple:
+    """One send-job item per row, and the number of duplicate sends the plan saves."""
+    import pandas as pd
+    from recipients import plan_recipients, recipients_by_row, count_duplicate_sends
+
+    # Rows without text or phones are kept so the job reports them as failed
+    plan = plan_recipients(frame if frame is not None else pd.DataFrame(records))
+    if records is None:
+        records = frame_records(frame)
+    # Numbers go in as planned, so the job sends them without normalizing again
+    recipients = recipients_by_row(plan, len(records))
+    job_items = [
+        {'row': row, 'message': row.get('Result'), **recipients[i]}
+        for i, row in enumerate(records)
+    ]
+    return job_items, count_duplicate_sends(plan)
+
+
+async def queue_send_job(current_user: User, kind: str, records: list = None, frame: pd.DataFrame = None) -> dict:
+    """Queue a send job with one item per row, given as row dicts or as a DataFrame."""
+    # Planning and row conversion are linear in the rows; keep them off the event loop
+    job_items, saved_count = await run_io(build_job_items, records, frame)
+    job_id = await create_job(current_user.id, kind, job_items)
+    return {
+        'job_id': job_id,
+        'status': 'queued',
+        'total': len(job_items),
+        'saved_count': saved_count,
+        'message': f'Send job queued for {len(job_items)} rows. Duplicate sends saved: {saved_count}'
     }
-    
-    # Include successful recipients if there are any
-    if successful_recipients:
-        response_data['successful_recipients'] = successful_recipients
-    
-    # Include failed recipients if there are any
-    if failed_recipients:
-        response_data['failed_recipients'] = failed_recipients
 
-    return response_data
+
+@app.get('/jobs/{job_id}')
+async def get_send_job(job_id: str, current_user: User = Depends(get_current_active_user)):
+    """Report progress of a send job. Recipient lists are included once the job has finished."""
+    job = await get_job(job_id)
+    if job is None or (current_user.role != 'admin' and job['user_id'] != current_user.id):
+        raise HTTPException(status_code=404, detail='Job not found')
+    if job['status'] in ('completed', 'failed'):
+        job = await get_job(job_id, include_recipients=True)
+    return job
 
 
 @app.post('/send-manual')
@@ -512,7 +478,7 @@ async def send_manual(request: dict, current_user: User = Depends(get_current_ac
     nums = [n.strip() for part in numbers_raw.split('\n') for n in part.split(',')]
     nums = [n for n in nums if n]
 
-    result = bulk_send(message, nums)
+    result = await bulk_send(message, nums)
 
     # Persist failed recipients
     if result.get('failed_recipients'):
@@ -536,16 +502,74 @@ async def send_manual(request: dict, current_user: User = Depends(get_current_ac
     return result
 
 
+def failed_sms_cursor(doc: dict) -> str:
+    return f"{doc['created_at'].isoformat()}_{doc['_id']}"
+
+
 @app.get('/failed-sms')
-async def list_failed_sms(current_user: User = Depends(get_current_active_user)):
-    """List failed sms for the current user (admins see all)."""
+async def list_failed_sms(
+    limit: int = 50,
+    after: Optional[str] = None,
+    resolved: Optional[bool] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    number: Optional[str] = None,
+    current_user: User = Depends(get_current_active_user),
+):
+    """List failed sms for the current user (admins see all), newest first, one page at a time.
+
+    Pass the returned `next` as `after` for the following page. Filters: resolved,
+    since/until (created_at range) and number (prefix of the number as typed or normalized).
+    `total` counts the filtered rows, stopping at FAILED_SMS_COUNT_LIMIT (`total_capped`);
+    it is only computed for the first page and is None on pages fetched with `after`."""
+    import re
+    from bson import ObjectId
+    from bson.errors import InvalidId
+
     coll = await get_failed_sms_collection()
-    results = []
-    async for doc in coll.find({} if current_user.role == 'admin' else {'user_id': current_user.id}):
-        doc['id'] = str(doc['_id'])
-        doc.pop('_id', None)
-        results.append(doc)
-    return results
+    query = {} if current_user.role == 'admin' else {'user_id': current_user.id}
+    if resolved is not None:
+        query['resolved'] = resolved
+    if since or until:
+        query['created_at'] = {**({'$gte': since} if since else {}), **({'$lt': until} if until else {})}
+    if number and number.strip():
+        # Anchored prefixes can use an index; typed and normalized forms are both tried
+        query['$or'] = [{'original_number': {'$regex': '^' + re.escape(number.strip())}}]
+        normalized = normalize_phone(number)
+        if normalized:
+            # Without digits the normalized prefix would be empty and match every record
+            query['$or'].append({'normalized': {'$regex': '^' + re.escape(normalized)}})
+
+    page_query = query
+    if after:
+        try:
+            created_at, last_id = after.rsplit('_', 1)
+            created_at, last_id = datetime.fromisoformat(created_at), ObjectId(last_id)
+        except (ValueError, InvalidId):
+            raise HTTPException(status_code=400, detail='Invalid cursor')
+        page_query = {'$and': [query, {'$or': [
+            {'created_at': {'$lt': created_at}},
+            {'created_at': created_at, '_id': {'$lt': last_id}},
+        ]}]}
+
+    limit = min(max(limit, 1), FAILED_SMS_MAX_LIMIT)
+    docs = await coll.find(page_query, FAILED_SMS_FIELDS).sort([('created_at', -1), ('_id', -1)]).to_list(limit + 1)
+    next_cursor = failed_sms_cursor(docs[limit - 1]) if len(docs) > limit else None
+    items = []
+    for doc in docs[:limit]:
+        doc['id'] = str(doc.pop('_id'))
+        items.append(doc)
+
+    # Only the first page counts; "Load more" keeps the total it already has
+    total = None
+    if not after:
+        if query:
+            total = await coll.count_documents(query, limit=FAILED_SMS_COUNT_LIMIT)
+        else:
+            # Whole collection (admin, no filters): collection metadata, no scan
+            total = await coll.estimated_document_count()
+    total_capped = bool(query) and total is not None and total >= FAILED_SMS_COUNT_LIMIT
+    return {'items': items, 'next': next_cursor, 'total': total, 'total_capped': total_capped}
 
 
 @app.post('/failed-sms/resend')
@@ -574,7 +598,7 @@ async def resend_failed_sms(request: dict, current_user: User = Depends(get_curr
     for idx, t in enumerate(to_process):
         msg = t.get('message') if isinstance(t, dict) else messages[idx]
         num = t.get('original_number') if isinstance(t, dict) else numbers[idx]
-        r = bulk_send(msg, [num])
+        r = await bulk_send(msg, [num])
         if r.get('failed_count', 0) == 0:
             # mark resolved
             try:
@@ -588,236 +612,231 @@ async def resend_failed_sms(request: dict, current_user: User = Depends(get_curr
     return {'successes': overall_success, 'failures': overall_failed}
 
 
+async def apply_template(ttype: str, df: pd.DataFrame, group_by=None, rows=None, source=None) -> pd.DataFrame:
+    """Render the Result column with a built-in layout ('varsity' | 'medical') or a stored template id.
+    group_by (a column name or list of names) ranks and takes the highest mark per group.
+    With rows (positions) ranking covers all of df but only those rows are rendered and returned.
+    With source (see request_source) the result is cached and reused for the same sheet and options."""
+    from templates import format_page, LAYOUTS
+    from sms_templates import render_template
+    from content_cache import rendered_results, render_key
+
+    if isinstance(group_by, str):
+        group_by = [group_by]
+    try:
+        if ttype in LAYOUTS:
+            key = render_key(source, ttype, group_by, rows) if source else None
+            out = rendered_results.get(key) if key else None
+            if out is None:
+                if rows is not None:
+                    out = await run_cpu(format_page, ttype, df, rows, group_by)
+                else:
+                    out = await run_cpu(LAYOUTS[ttype][1], df, group_by)
+                if key:
+                    rendered_results.put(key, out)
+            return out
+        out = await render_template(ttype, df, group_by, rows, source) if ttype else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if out is None:
+        raise HTTPException(status_code=400, detail='unknown template type')
+    return out
+
+
+@app.get('/sms-templates')
+async def get_sms_templates(current_user: User = Depends(get_current_active_user)):
+    """List stored SMS templates; their ids can be used as 'type' on /templates/*."""
+    from sms_templates import list_templates
+    return {'templates': await list_templates()}
+
+
+@app.post('/sms-templates')
+async def add_sms_template(template: SmsTemplateCreate, current_user: User = Depends(get_current_admin_user)):
+    from sms_templates import create_template
+    try:
+        return await create_template(template.model_dump(), current_user.id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.put('/sms-templates/{template_id}')
+async def edit_sms_template(template_id: str, template: SmsTemplateUpdate, current_user: User = Depends(get_current_admin_user)):
+    from sms_templates import update_template
+    try:
+        updated = await update_template(template_id, template.model_dump(exclude_unset=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if updated is None:
+        raise HTTPException(status_code=404, detail='Template not found')
+    return updated
+
+
+@app.delete('/sms-templates/{template_id}')
+async def remove_sms_template(template_id: str, current_user: User = Depends(get_current_admin_user)):
+    from sms_templates import delete_template
+    if not await delete_template(template_id):
+        raise HTTPException(status_code=404, detail='Template not found')
+    return {'message': 'Template deleted successfully'}
+
+
 @app.post('/templates/preview')
 async def templates_preview(request: dict, current_user: User = Depends(get_current_active_user)):
-    """Preview formatted Result column for provided Excel bytes or data records. Expects {'data': [...], 'type': 'varsity'|'medical'}"""
+    """Preview formatted Result column for provided data records or a stored dataset.
+    Expects {'data': [...] | 'dataset_id': ..., 'type': 'varsity'|'medical'|<template id>, 'group_by'?: [...]}
+
+    Optional 'offset'/'limit' or 'sample': N (random rows, 'seed' to repeat) return only
+    those rows; Position and Highest Marks are still computed over the whole sheet."""
+    import numpy as np
+
     ttype = request.get('type')
-    data = request.get('data')
-    if data is None:
-        # allow Excel bytes (base64) not implemented here
-        raise HTTPException(status_code=400, detail='data required')
-    df = pd.DataFrame(data)
-    if ttype == 'varsity':
-        out = format_varsity_results(df)
-    elif ttype == 'medical':
-        out = format_medical_results(df)
-    else:
-        raise HTTPException(status_code=400, detail='unknown template type')
+    df = request_frame(request, current_user)
+    total = len(df)
+
+    sample = int_field(request, 'sample', 0)
+    seed = int_field(request, 'seed', 0)
+    offset = int_field(request, 'offset', 0)
+    limit = int_field(request, 'limit', 0)
+
+    rows = None
+    if sample is not None:
+        n = min(sample, total)
+        rows = np.sort(np.random.default_rng(seed).choice(total, size=n, replace=False))
+    elif offset is not None or limit is not None:
+        offset = offset or 0
+        end = total if limit is None else min(offset + limit, total)
+        rows = np.arange(min(offset, total), end)
+
+    out = await apply_template(ttype, df, request.get('group_by'), rows, request_source(request, current_user))
     # Return full rows including generated Result so frontend can preview and send
     # Convert NaN to None for JSON serializability
     out = out.fillna('')
-    return {'preview': out.to_dict('records')}
+    response = {'preview': out.to_dict('records'), 'total': total}
+    if rows is not None:
+        response['rows'] = rows.tolist()
+    return response
 
 
 @app.post('/templates/download')
 async def templates_download(request: dict, current_user: User = Depends(get_current_active_user)):
-    """Return an Excel file of the formatted template applied to provided data."""
+    """Return an Excel file of the formatted template applied to provided data or a stored dataset."""
+    from exports import export_response
+
     ttype = request.get('type')
-    data = request.get('data')
-    if data is None:
-        raise HTTPException(status_code=400, detail='data required')
-    df = pd.DataFrame(data)
-    if ttype == 'varsity':
-        out = format_varsity_results(df)
-    elif ttype == 'medical':
-        out = format_medical_results(df)
-    else:
-        raise HTTPException(status_code=400, detail='unknown template type')
+    df = request_frame(request, current_user)
+    out = await apply_template(ttype, df, request.get('group_by'), source=request_source(request, current_user))
 
-    output = BytesIO()
-    out.to_excel(output, index=False, engine='xlsxwriter')
-    output.seek(0)
-    filename = f"Template_{ttype}.xlsx"
-    return StreamingResponse(BytesIO(output.read()), media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", headers={"Content-Disposition": f"attachment; filename={filename}"})
+    return export_response(out, f"Template_{ttype}", export_format(request))
 
 
 @app.post('/templates/send')
 async def templates_send(request: dict, current_user: User = Depends(get_current_active_user)):
-    """Apply template to provided data and send SMS to valid numbers. Expects {'data': [...], 'type': 'varsity'|'medical'}"""
+    """Apply template to provided data and queue a send job for valid numbers.
+    Expects {'data': [...] | 'dataset_id': ..., 'type': 'varsity'|'medical'|<template id>, 'group_by'?: [...]}"""
     ttype = request.get('type')
-    data = request.get('data')
-    if data is None:
-        raise HTTPException(status_code=400, detail='data required')
-    df = pd.DataFrame(data)
-    if ttype == 'varsity':
-        out = format_varsity_results(df)
-    elif ttype == 'medical':
-        out = format_medical_results(df)
-    else:
-        raise HTTPException(status_code=400, detail='unknown template type')
+    df = request_frame(request, current_user)
+    out = await apply_template(ttype, df, request.get('group_by'), source=request_source(request, current_user))
+
+    return await queue_send_job(current_user, 'templates-send', frame=out)
+
+
+async def owned_exam(exam_id: str, current_user: User) -> dict:
+    from exams import get_exam
+    exam = await get_exam(exam_id)
+    if exam is None or (current_user.role != 'admin' and exam['user_id'] != current_user.id):
+        raise HTTPException(status_code=404, detail='Exam not found')
+    return exam
 
-    sent_count = 0
-    failed_count = 0
-    failed_recipients = []
-    successful_recipients = []
-
-    for _, row in out.iterrows():
-        sms = row.get('Result')
-        # gather phones
-        phones = []
-        for k in ['Guardian Phone No', 'Guardian Phone', 'Student Phone No', 'Student Phone']:
-            if k in row and pd.notna(row[k]):
-                phones.append(str(row[k]))
-
-        if not phones:
-            failed_count += 1
-            failed_recipients.append(row.to_dict())
-            continue
-
-        res = bulk_send(sms, phones)
-        sent_count += res.get('sent_count', 0)
-        failed_count += res.get('failed_count', 0)
-        if res.get('successful_recipients'):
-            successful_recipients.extend(res.get('successful_recipients'))
-        if res.get('failed_recipients'):
-            failed_recipients.extend(res.get('failed_recipients'))
-
-    response_data = {
-        'message': f'SMS sent to {sent_count} numbers. Failed: {failed_count}',
-        'sent_count': sent_count,
-        'failed_count': failed_count
-    }
-    if successful_recipients:
-        response_data['successful_recipients'] = successful_recipients
-    if failed_recipients:
-        response_data['failed_recipients'] = failed_recipients
-    return response_data
+
+@app.post('/exams')
+async def create_exam_ranking(request: dict, current_user: User = Depends(get_current_active_user)):
+    """Start a multi-center exam ranking. Expects {'name': ..., 'type': 'varsity'|'medical'|<template id>}"""
+    from exams import create_exam
+    try:
+        return await create_exam(current_user.id, request.get('name') or 'Exam', request.get('type'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get('/exams')
+async def get_exam_rankings(current_user: User = Depends(get_current_active_user)):
+    from exams import list_exams
+    return {'exams': await list_exams(None if current_user.role == 'admin' else current_user.id)}
+
+
+@app.post('/exams/{exam_id}/batches')
+async def add_exam_batch(exam_id: str, request: dict, current_user: User = Depends(get_current_active_user)):
+    """Merge one center's results into the exam ranking. Expects {'data': [...] | 'dataset_id': ..., 'label'?: ...}"""
+    from exams import add_batch
+    exam = await owned_exam(exam_id, current_user)
+    df = request_frame(request, current_user)
+    try:
+        return await add_batch(exam, df, request.get('label'))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get('/exams/{exam_id}')
+async def get_exam_ranking(exam_id: str, offset: int = 0, limit: int = 100, current_user: User = Depends(get_current_active_user)):
+    """Exam summary and a page of its rows with current Position and Result."""
+    from exams import exam_results
+    exam = await owned_exam(exam_id, current_user)
+    offset = max(offset, 0)
+    limit = min(max(limit, 1), EXAM_RESULTS_MAX_LIMIT)
+    results = await exam_results(exam, offset, limit)
+    exam['exam_id'] = str(exam.pop('_id'))
+    return {'exam': exam, 'results': results, 'offset': offset, 'limit': limit}
+
+
+@app.post('/exams/{exam_id}/send')
+async def send_exam_results(exam_id: str, current_user: User = Depends(get_current_active_user)):
+    """Queue a send job for every row of the exam with its merged-cohort Result."""
+    from exams import exam_results
+    exam = await owned_exam(exam_id, current_user)
+    return await queue_send_job(current_user, 'exam-send', await exam_results(exam))
 
 @app.post("/export-excel")
 async def export_excel(request: dict, current_user: User = Depends(get_current_active_user)):
     """
-    Export data to two separate Excel files in a ZIP:
+    Export data to two separate Excel files (or CSV/Parquet with 'format') in a ZIP:
     1. Success.xlsx - numbers that would successfully receive SMS
     2. Failed.xlsx - numbers that would fail to receive SMS
+    Optional 'store_xlsx' (bool) and 'compression_level' (0-9) override EXPORT_ZIP_STORE / EXPORT_ZIP_LEVEL.
     """
-    from fastapi.responses import StreamingResponse
     import pandas as pd
-    from io import BytesIO
-    import os
-    import zipfile
     from datetime import datetime
+    from recipients import plan_recipients, rows_with_valid_recipient
+    from exports import export_zip_response
 
-    data = request.get('data', [])
+    fmt = export_format(request)
+    store, level = zip_options(request)
+    if request.get('dataset_id'):
+        df = request_frame(request, current_user)
+    else:
+        df = pd.DataFrame(request.get('data', []))
 
-    # Simulate SMS sending to categorize success/failure
-    success_recipients = []
-    failed_recipients = []
-
-    for item in data:
-        sms_text = item.get('Result')
-        if not sms_text:
-            # No SMS text, add to failed
-            failed_recipients.append(item)
-            continue
-
-        # Get both student and guardian phone numbers
-        phones_to_send = []
-
-        # Look for guardian phone in various column names
-        guardian_phone = None
-        student_phone = None
-
-        phone_keys = ['Guardian Phone No', 'Guardian  Phone No', 'Guardian Phone', 'GuardianPhone']
-        for key in phone_keys:
-            if key in item and item.get(key) not in (None, '', 'nan'):
-                guardian_phone = str(item.get(key)).strip()
-                break
-
-        # Look for student phone
-        student_keys = ['Student Phone No', 'Student Phone']
-        for key in student_keys:
-            if key in item and item.get(key) not in (None, '', 'nan'):
-                student_phone = str(item.get(key)).strip()
-                break
-
-        # Add guardian phone if available
-        if guardian_phone and guardian_phone.lower() not in ('nan', 'none', ''):
-            phones_to_send.append(guardian_phone)
-
-        # Add student phone if available
-        if student_phone and student_phone.lower() not in ('nan', 'none', ''):
-            phones_to_send.append(student_phone)
-
-        # If no valid phones, add to failed
-        if not phones_to_send:
-            failed_recipients.append(item)
-            continue
-
-        # Simulate SMS sending for each phone
-        item_success = False
-        valid_phones = []
-        
-        for phone in phones_to_send:
-            # Normalize phone: remove spaces, dashes and parentheses
-            phone = phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-            # Remove any non-digit characters
-            phone = ''.join(ch for ch in phone if ch.isdigit())
-
-            # Normalize phone number format for Bangladesh
-            if phone.startswith('880'):
-                norm_phone = phone
-            elif phone.startswith('0'):
-                norm_phone = '880' + phone.lstrip('0')
-            elif len(phone) == 10:
-                norm_phone = '880' + phone
-            elif len(phone) == 11 and phone.startswith('1'):
-                norm_phone = '880' + phone
-            else:
-                norm_phone = phone
-
-            # Validate phone number length (must be at least 11 digits)
-            if len(norm_phone) >= 11:
-                valid_phones.append(norm_phone)
-                item_success = True
-                break  # If any phone is valid, consider the whole item successful
-
-        # If no valid phones found, mark as failed
-        if not valid_phones:
-            failed_recipients.append(item)
+    # Categorize rows: a row would succeed if it has a message and at least one sendable number
+    plan = await run_io(plan_recipients, df)
+    sendable = rows_with_valid_recipient(plan, len(df))
+    df_success = df[sendable].reset_index(drop=True)
+    df_failed = df[~sendable].reset_index(drop=True)
 
     # Create timestamp for filenames
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
-    # Create ZIP file containing both Excel files
-    zip_buffer = BytesIO()
-
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        # Create Success Excel file
-        if success_recipients:
-            success_output = BytesIO()
-            df_success = pd.DataFrame(success_recipients)
-            df_success.to_excel(success_output, index=False, engine='xlsxwriter')
-            success_output.seek(0)
-            zip_file.writestr(f'Success_{timestamp}.xlsx', success_output.read())
-        else:
-            # Create empty success file
-            success_output = BytesIO()
-            pd.DataFrame(columns=['No Successful Recipients Found']).to_excel(success_output, index=False, engine='xlsxwriter')
-            success_output.seek(0)
-            zip_file.writestr(f'Success_{timestamp}.xlsx', success_output.read())
-
-        # Create Failed Excel file
-        if failed_recipients:
-            failed_output = BytesIO()
-            df_failed = pd.DataFrame(failed_recipients)
-            df_failed.to_excel(failed_output, index=False, engine='xlsxwriter')
-            failed_output.seek(0)
-            zip_file.writestr(f'Failed_{timestamp}.xlsx', failed_output.read())
-        else:
-            # Create empty failed file
-            failed_output = BytesIO()
-            pd.DataFrame(columns=['No Failed Recipients Found']).to_excel(failed_output, index=False, engine='xlsxwriter')
-            failed_output.seek(0)
-            zip_file.writestr(f'Failed_{timestamp}.xlsx', failed_output.read())
-
-    zip_buffer.seek(0)
+    # Empty categories still get a workbook, with a header saying so
+    if df_success.empty:
+        df_success = pd.DataFrame(columns=['No Successful Recipients Found'])
+    if df_failed.empty:
+        df_failed = pd.DataFrame(columns=['No Failed Recipients Found'])
 
-    # Return ZIP file as download
+    # Both Excel files are written in parallel workers and streamed into the zip as each finishes
     zip_filename = f"SMS_Categorized_{timestamp}.zip"
-    return StreamingResponse(
-        BytesIO(zip_buffer.read()),
-        media_type="application/zip",
-        headers={"Content-Disposition": f"attachment; filename={zip_filename}"}
+    return export_zip_response(
+        {f'Success_{timestamp}': df_success, f'Failed_{timestamp}': df_failed},
+        zip_filename,
+        fmt,
+        store=store,
+        level=level,
     )
 
 @app.post("/download-success")
@@ -825,86 +844,55 @@ async def download_success(request: dict, current_user: User = Depends(get_curre
     """
     Download successful recipients as Excel file after SMS sending
     """
-    from fastapi.responses import StreamingResponse
     import pandas as pd
-    from io import BytesIO
     from datetime import datetime
+    from exports import export_response
 
-    successful_recipients = request.get('successful_recipients', [])
+    fmt = export_format(request)
+    # Rows of a stored dataset ({'dataset_id', 'rows'}) or the rows themselves
+    if request.get('dataset_id'):
+        df = request_frame(request, current_user)
+    else:
+        df = pd.DataFrame(request.get('successful_recipients', []))
 
-    if not successful_recipients:
+    if df.empty:
         # Return empty Excel if no successful recipients
-        output = BytesIO()
-        pd.DataFrame(columns=['No Successful Recipients']).to_excel(output, index=False, engine='xlsxwriter')
-        output.seek(0)
-
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"No_Successful_Recipients_{timestamp}.xlsx"
-        return StreamingResponse(
-            BytesIO(output.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-
-    # Create Excel file with successful recipients
-    output = BytesIO()
-    df_success = pd.DataFrame(successful_recipients)
-    df_success.to_excel(output, index=False, engine='xlsxwriter')
-    output.seek(0)
+        return export_response(pd.DataFrame(columns=['No Successful Recipients']), f"No_Successful_Recipients_{timestamp}", fmt)
 
     # Create filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"Successful_Recipients_{timestamp}.xlsx"
+    basename = f"Successful_Recipients_{timestamp}"
 
-    # Return file as download
-    return StreamingResponse(
-        BytesIO(output.read()),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    # Stream the Excel file with successful recipients as it is written
+    return export_response(df, basename, fmt)
 
 @app.post("/download-failed")
 async def download_failed(request: dict, current_user: User = Depends(get_current_active_user)):
     """
     Download failed recipients as Excel file after SMS sending
     """
-    from fastapi.responses import StreamingResponse
     import pandas as pd
-    from io import BytesIO
     from datetime import datetime
+    from exports import export_response
 
-    failed_recipients = request.get('failed_recipients', [])
+    fmt = export_format(request)
+    if request.get('dataset_id'):
+        df = request_frame(request, current_user)
+    else:
+        df = pd.DataFrame(request.get('failed_recipients', []))
 
-    if not failed_recipients:
+    if df.empty:
         # Return empty Excel if no failed recipients
-        output = BytesIO()
-        pd.DataFrame(columns=['No Failed Recipients']).to_excel(output, index=False, engine='xlsxwriter')
-        output.seek(0)
-
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"No_Failed_Recipients_{timestamp}.xlsx"
-        return StreamingResponse(
-            BytesIO(output.read()),
-            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            headers={"Content-Disposition": f"attachment; filename={filename}"}
-        )
-
-    # Create Excel file with failed recipients
-    output = BytesIO()
-    df_failed = pd.DataFrame(failed_recipients)
-    df_failed.to_excel(output, index=False, engine='xlsxwriter')
-    output.seek(0)
+        return export_response(pd.DataFrame(columns=['No Failed Recipients']), f"No_Failed_Recipients_{timestamp}", fmt)
 
     # Create filename with timestamp
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"Failed_Recipients_{timestamp}.xlsx"
+    basename = f"Failed_Recipients_{timestamp}"
 
-    # Return file as download
-    return StreamingResponse(
-        BytesIO(output.read()),
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    # Stream the Excel file with failed recipients as it is written
+    return export_response(df, basename, fmt)
 
 @app.get("/check-balance")
 async def check_balance(current_user: User = Depends(get_current_admin_user)):
@@ -920,7 +908,8 @@ async def check_balance(current_user: User = Depends(get_current_admin_user)):
     try:
         # Call BulkSMS BD balance API
         balance_url = f"http://bulksmsbd.net/api/getBalanceApi?api_key={api_key}"
-        response = requests.get(balance_url, timeout=30)
+        client = await get_client()
+        response = await client.get(balance_url)
 
         if response.status_code == 200:
             try:
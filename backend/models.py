@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, field_validator
 from typing import Optional
 from datetime import datetime
 from enum import Enum
@@ -50,6 +50,26 @@ class UserUpdate(BaseModel):
     password: Optional[str] = None
     full_name: Optional[str] = None
 
+class SmsTemplateCreate(BaseModel):
+    name: str
+    body: str
+    absent_body: Optional[str] = None
+    score_column: Optional[str] = None
+
+class SmsTemplateUpdate(BaseModel):
+    name: Optional[str] = None
+    body: Optional[str] = None
+    absent_body: Optional[str] = None
+    score_column: Optional[str] = None
+
+    @field_validator("name", "body")
+    @classmethod
+    def not_null(cls, value):
+        # Omit a field to keep it; name and body cannot be cleared
+        if value is None:
+            raise ValueError("cannot be null")
+        return value
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
@@ -0,0 +1,93 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+from sms_sender import normalize_phones
+
+# Candidate column names per recipient role, in lookup priority order
+GUARDIAN_PHONE_KEYS = ['Guardian Phone No', 'Guardian  Phone No', 'Guardian Phone', 'GuardianPhone']
+STUDENT_PHONE_KEYS = ['Student Phone No', 'Student Phone']
+ROLE_KEYS = [('guardian', GUARDIAN_PHONE_KEYS), ('student', STUDENT_PHONE_KEYS)]
+
+PLAN_COLUMNS = ['row', 'role', 'number', 'normalized', 'message', 'valid']
+
+# Placeholder strings that mean "no value" once a column is rendered as text
+_BLANKS = ['', 'nan', 'NaN', 'NAN', 'none', 'None', 'NONE', '<NA>']
+
+
+def _as_text(col: pd.Series) -> pd.Series:
+    """Return a column as stripped strings with blanks, 'nan' and 'none' as <NA>."""
+    if pd.api.types.is_numeric_dtype(col) and not pd.api.types.is_bool_dtype(col):
+        # Excel hands phone numbers over as floats (1712345678.0); drop the fraction
+        col = pd.to_numeric(col, errors='coerce').round().astype('Int64')
+    text = col.astype('string').str.strip()
+    return text.mask(text.isin(_BLANKS))
+
+
+def _coalesce(df: pd.DataFrame, keys: List[str]) -> Optional[pd.Series]:
+    """First non-empty value per row across the candidate columns."""
+    out = None
+    for key in keys:
+        if key in df.columns:
+            col = _as_text(df[key])
+            out = col if out is None else out.fillna(col)
+    return out
+
+
+def plan_recipients(df: pd.DataFrame, message_col: str = 'Result') -> pd.DataFrame:
+    """Turn a dataset into a flat recipient plan.
+
+    Returns one row per (row, role) that has both a message and a phone, with columns
+    row (position in df), role ('guardian' | 'student'), number (as found), normalized,
+    message and valid (normalized number is long enough to send). Guardian comes
+    before student within a row.
+    """
+    messages = _as_text(df[message_col]) if message_col in df.columns else pd.Series(pd.NA, index=df.index, dtype='string')
+    positions = np.arange(len(df))
+
+    parts = []
+    for order, (role, keys) in enumerate(ROLE_KEYS):
+        numbers = _coalesce(df, keys)
+        if numbers is None:
+            continue
+        mask = (numbers.notna() & messages.notna()).to_numpy()
+        parts.append(pd.DataFrame({
+            'row': positions[mask],
+            'order': order,
+            'role': role,
+            'number': numbers[mask].astype(object).to_numpy(),
+            'message': messages[mask].astype(object).to_numpy(),
+        }))
+
+    if not parts:
+        return pd.DataFrame({c: pd.Series(dtype=object) for c in PLAN_COLUMNS})
+
+    plan = pd.concat(parts, ignore_index=True).sort_values(['row', 'order'], kind='stable', ignore_index=True)
+    normalized, valid = normalize_phones(plan['number'].to_numpy())
+    plan['normalized'] = normalized.astype(object)
+    plan['valid'] = valid
+    return plan[PLAN_COLUMNS]
+
+
+def recipients_by_row(plan: pd.DataFrame, n_rows: int) -> List[Dict[str, list]]:
+    """Planned recipients per row position as parallel lists: phones (as found),
+    normalized and valid. Rows without recipients get empty lists."""
+    out = [{'phones': [], 'normalized': [], 'valid': []} for _ in range(n_rows)]
+    columns = (plan['row'].to_numpy(), plan['number'].tolist(), plan['normalized'].tolist(), plan['valid'].tolist())
+    for row, number, normalized, valid in zip(*columns):
+        out[row]['phones'].append(number)
+        out[row]['normalized'].append(normalized)
+        out[row]['valid'].append(bool(valid))
+    return out
+
+
+def rows_with_valid_recipient(plan: pd.DataFrame, n_rows: int) -> np.ndarray:
+    """Boolean mask over row positions: True where at least one number is sendable."""
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[plan.loc[plan['valid'], 'row'].to_numpy(dtype=int)] = True
+    return mask
+
+
+def count_duplicate_sends(plan: pd.DataFrame) -> int:
+    """Sendable recipients whose (normalized number, message) pair already occurs earlier in the plan."""
+    sendable = plan.loc[plan['valid'], ['normalized', 'message']]
+    return int(sendable.duplicated().sum())
@@ -0,0 +1,72 @@
+import sys
+import os
+import time
+import random
+
+# Ensure backend dir is on sys.path so imports of local modules succeed
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+from sms_sender import normalize_phone, normalize_phones
+
+
+def normalize_phone_loop(phone):
+    """The previous per-string implementation, kept here as the baseline."""
+    if phone is None:
+        return ''
+    p = str(phone).replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+    p = ''.join(ch for ch in p if ch.isdigit())
+
+    if p.startswith('880'):
+        norm = p
+    elif p.startswith('0'):
+        norm = '880' + p.lstrip('0')
+    elif len(p) == 10:
+        norm = '880' + p
+    elif len(p) == 11 and p.startswith('1'):
+        norm = '880' + p
+    else:
+        norm = p
+    return norm
+
+
+def make_numbers(n):
+    """Mix of the formats operators paste into sheets."""
+    random.seed(42)
+    formats = ['0{}', '+880 {}', '880{}', '{}', '({}) ', '0{}-', ' 0{} ']
+    numbers = []
+    for _ in range(n):
+        local = '1' + ''.join(random.choice('0123456789') for _ in range(9))
+        numbers.append(random.choice(formats).format(local))
+    return numbers
+
+
+def best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    numbers = make_numbers(n)
+
+    loop = best_of(lambda: [len(normalize_phone_loop(p)) >= 11 for p in numbers])
+    vectorized = best_of(lambda: normalize_phones(numbers))
+
+    normalized, valid = normalize_phones(numbers)
+    assert normalized.tolist() == [normalize_phone_loop(p) for p in numbers]
+    assert normalize_phone(numbers[0]) == normalized[0]
+
+    print(f'{n} numbers, {int(valid.sum())} valid')
+    print(f'per-string loop:               {loop * 1000:8.1f} ms')
+    print(f'normalize_phones (vectorized): {vectorized * 1000:8.1f} ms')
+    print(f'speedup: {loop / vectorized:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
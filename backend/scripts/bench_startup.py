@@ -0,0 +1,78 @@
+import sys
+import os
+import time
+import socket
+import statistics
+import subprocess
+import urllib.error
+import urllib.request
+
+# Ensure backend dir is on sys.path so imports of local modules succeed
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+# Modules a cold start should not load before the first sheet request
+HEAVY_MODULES = ['pandas', 'openpyxl', 'xlsxwriter']
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def import_time():
+    """Seconds to import main in a fresh interpreter, and which heavy modules that loaded."""
+    code = (
+        'import sys, time; t = time.perf_counter(); import main; '
+        'print(time.perf_counter() - t); '
+        f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+    )
+    out = subprocess.run([sys.executable, '-c', code], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    # Last two lines; the second is empty when no heavy module was loaded
+    seconds, loaded = out.stdout.split('\n')[-3:-1]
+    return float(seconds), loaded
+
+
+def time_to_healthy(timeout=60):
+    """Start uvicorn and return seconds until GET /healthz first answers 200."""
+    port = free_port()
+    url = f'http://127.0.0.1:{port}/healthz'
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=BACKEND_DIR,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f'server exited with code {server.returncode}')
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except (urllib.error.URLError, ConnectionError, socket.timeout):
+                pass
+            time.sleep(0.02)
+        raise RuntimeError(f'/healthz not healthy after {timeout}s')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    """Needs the usual .env (MongoDB, ADMIN_*), since /healthz pings the database."""
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    seconds, loaded = import_time()
+    print(f'import main:             {seconds * 1000:8.1f} ms (heavy modules loaded: {loaded or "none"})')
+
+    times = [time_to_healthy() for _ in range(runs)]
+    print(f'time to first healthy response over {runs} starts:')
+    print(f'  min:                   {min(times) * 1000:8.1f} ms')
+    print(f'  median:                {statistics.median(times) * 1000:8.1f} ms')
+    print(f'  max:                   {max(times) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import asyncio
+import os
+import sys
+
+# Ensure backend dir is on sys.path so imports of local modules succeed
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+# Connect without creating anything; only report
+os.environ['MONGO_INDEX_MODE'] = 'off'
+
+import database
+
+
+async def main():
+    await database.init_database()
+    report = await database.check_indexes(database.database)
+    for name in report['missing']:
+        print('missing index:', name)
+    for query in report['collection_scans']:
+        print('collection scan:', query)
+    if not report['missing'] and not report['collection_scans']:
+        print('all indexes present; no collection scans')
+    return 1 if report['missing'] or report['collection_scans'] else 0
+
+sys.exit(asyncio.run(main()))
@@ -1,86 +1,286 @@
 import os
-import requests
+import json
+import time
+import asyncio
+import httpx
+import numpy as np
 from typing import List, Tuple, Dict, Any
 
 API_URL = os.getenv('SMS_API_URL', 'http://bulksmsbd.net/api/smsapi')
+MANY_API_URL = os.getenv('SMS_MANY_API_URL', 'http://bulksmsbd.net/api/smsapimany')
 API_KEY = os.getenv('SMS_API_KEY')
 SENDER_ID = os.getenv('SMS_SENDER_ID', '8809617624071')
 DRY_RUN = os.getenv('SMS_DRY_RUN', 'false').lower() in ('1', 'true', 'yes')
+SMS_TIMEOUT = float(os.getenv('SMS_TIMEOUT', 30))
+SMS_POOL_SIZE = int(os.getenv('SMS_POOL_SIZE', 20))
+# Max provider requests in flight per bulk_send call, and the account-wide per-second quota
+SMS_CONCURRENCY = int(os.getenv('SMS_CONCURRENCY', 10))
+SMS_RATE_PER_SEC = float(os.getenv('SMS_RATE_PER_SEC', 20))
+# Numbers packed into one provider request when the same message goes to many recipients
+SMS_BATCH_SIZE = int(os.getenv('SMS_BATCH_SIZE', 100))
+# (number, message) pairs packed into one many-to-many request for personalized messages
+SMS_MANY_BATCH_SIZE = int(os.getenv('SMS_MANY_BATCH_SIZE', 50))
+
+# Provider codes that reject the whole request regardless of the recipients
+ACCOUNT_ERROR_CODES = {1002, 1003, 1007, 1008, 1010, 1011, 1031, 1032}
+
+# Shared keep-alive connection pool to the provider, opened/closed in main.lifespan
+_client = None
+
+
+async def open_client() -> httpx.AsyncClient:
+    """Create the shared provider client if it does not exist yet."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=SMS_TIMEOUT,
+            limits=httpx.Limits(max_connections=SMS_POOL_SIZE, max_keepalive_connections=SMS_POOL_SIZE),
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def get_client() -> httpx.AsyncClient:
+    # Lazily opens the pool for callers running outside the app lifespan (scripts)
+    return await open_client()
+
+
+class TokenBucket:
+    """Async token bucket: allows `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(rate, 1)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# One limiter per process: the provider quota applies to the whole account, not per request
+_rate_limiter = TokenBucket(SMS_RATE_PER_SEC)
+
+
+# Bengali digits ০-৯ read as their ASCII counterparts
+BENGALI_DIGITS = str.maketrans('০১২৩৪৫৬৭৮৯', '0123456789')
+
+
+def normalize_phones(phones) -> Tuple[np.ndarray, np.ndarray]:
+    """Normalize a whole column of phone numbers to the Bangladesh 880 format.
+
+    Accepts any sequence (list, numpy array, pandas Series). Runs pandas string
+    operations on Arrow-backed strings over the whole column: strips non-digits
+    (Bengali digits count as digits), prefixes 880 and checks the length. Returns
+    (normalized, valid) as a numpy object array of str and a numpy bool array.
+    """
+    import pandas as pd
+
+    text = pd.Series(np.asarray(phones, dtype=object).ravel(), dtype=object)
+    missing = text.isna()  # None, NaN, NaT or pd.NA
+    if missing.any():
+        text = text.where(~missing, '')
+    text = text.astype(str).astype('string[pyarrow]')
+    # Excel hands phone numbers over as floats: 1712345678.0 -> 1712345678
+    text = text.str.replace(r'\.0$', '', regex=True)
+    digits = text.str.replace(r'[^0-9০-৯]', '', regex=True)
+    bengali = digits.str.contains('[০-৯]', regex=True)
+    if bengali.any():
+        digits[bengali] = digits[bengali].astype(object).str.translate(BENGALI_DIGITS)
+
+    starts_0 = digits.str.startswith('0')
+    length = digits.str.len()
+    local = ~starts_0 & ~digits.str.startswith('880') & (
+        (length == 10) | ((length == 11) & digits.str.startswith('1'))
+    )
+    # 0-prefixed numbers lose their leading zeros, then both kinds get the 880 prefix
+    digits = digits.mask(starts_0, digits.str.lstrip('0'))
+    normalized = digits.mask(starts_0 | local, '880' + digits)
+    return normalized.to_numpy(dtype=object), (normalized.str.len() >= 11).to_numpy(dtype=bool)
 
 
 def normalize_phone(phone: str) -> str:
-    if phone is None:
-        return ''
-    p = str(phone).replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
-    p = ''.join(ch for ch in p if ch.isdigit())
-
-    if p.startswith('880'):
-        norm = p
-    elif p.startswith('0'):
-        norm = '880' + p.lstrip('0')
-    elif len(p) == 10:
-        norm = '880' + p
-    elif len(p) == 11 and p.startswith('1'):
-        norm = '880' + p
-    else:
-        norm = p
-    return norm
-
-
-def send_sms_to_number(number: str, message: str, api_key: str = None) -> Tuple[bool, str]:
-    """Send a single SMS, return (success, info)."""
-    api_key = api_key or API_KEY
-    if not api_key or DRY_RUN:
-        # Dry run or missing key - pretend success for valid-looking numbers
-        return True, 'dry-run or no api key'
+    return str(normalize_phones([phone])[0][0])
+
+
+def parse_provider_response(status_code: int, text: str) -> Tuple[bool, str]:
+    """Interpret a provider response, return (success, info)."""
+    if status_code != 200:
+        return False, f'HTTP {status_code}: {text}'
+    txt = text.strip()
+    # Basic heuristics for success
+    if txt.startswith('{'):
+        try:
+            j = json.loads(txt)
+            # IP whitelisting errors come back as HTTP 200 with code 1032
+            if j.get('response_code') in (1032, '1032') or 'not whitelisted' in str(j.get('error_message', '')).lower():
+                return False, txt
+            if j.get('response_code') in (1001, '1001') or 'success' in str(j.get('success_message', '')).lower():
+                return True, txt
+            else:
+                return False, txt
+        except Exception:
+            pass
+    if 'success' in txt.lower() or any(code in txt for code in ['1001', '200', '201']):
+        return True, txt
+    return False, txt
 
+
+def response_code(info: str):
+    """Extract the provider response_code from a JSON response body, if any."""
+    try:
+        return int(json.loads(info).get('response_code'))
+    except Exception:
+        return None
+
+
+async def _submit(number: str, message: str, api_key: str) -> Tuple[bool, str]:
+    """POST one provider request. `number` may be a comma-separated list.
+    Transport errors propagate to the caller."""
     payload = {
         'api_key': api_key,
         'senderid': SENDER_ID,
         'number': number,
         'message': message,
     }
+    client = await get_client()
+    await _rate_limiter.acquire()
+    resp = await client.post(API_URL, data=payload)
+    return parse_provider_response(resp.status_code, resp.text)
+
+
+async def _submit_many(pairs: List[Tuple[str, str]], api_key: str) -> Tuple[bool, str]:
+    """POST one many-to-many provider request. Transport errors propagate to the caller."""
+    payload = {
+        'api_key': api_key,
+        'senderid': SENDER_ID,
+        'messages': json.dumps([{'to': number, 'message': message} for number, message in pairs], ensure_ascii=False),
+    }
+    client = await get_client()
+    await _rate_limiter.acquire()
+    resp = await client.post(MANY_API_URL, data=payload)
+    return parse_provider_response(resp.status_code, resp.text)
+
+
+async def send_sms_to_number(number: str, message: str, api_key: str = None) -> Tuple[bool, str]:
+    """Send a single SMS, return (success, info)."""
+    api_key = api_key or API_KEY
+    if not api_key or DRY_RUN:
+        # Dry run or missing key - pretend success for valid-looking numbers
+        return True, 'dry-run or no api key'
+
     try:
-        resp = requests.post(API_URL, data=payload, timeout=30)
-        if resp.status_code == 200:
-            txt = resp.text.strip()
-            # Basic heuristics for success
-            if txt.startswith('{'):
-                try:
-                    j = resp.json()
-                    if j.get('response_code') in (1001, '1001') or 'success' in str(j).lower():
-                        return True, txt
-                    else:
-                        return False, txt
-                except Exception:
-                    pass
-            if 'success' in txt.lower() or any(code in txt for code in ['1001', '200', '201']):
-                return True, txt
-            return False, txt
-        else:
-            return False, f'HTTP {resp.status_code}: {resp.text}'
+        return await _submit(number, message, api_key)
     except Exception as e:
         return False, str(e)
 
 
-def bulk_send(message: str, numbers: List[str]) -> Dict[str, Any]:
-    """Send message to multiple numbers. Returns dict with sent_count, failed_count, lists."""
-    sent_count = 0
-    failed = []
-    success = []
+async def _send_each(pairs: List[Tuple[str, str]], api_key: str) -> List[Tuple[bool, str]]:
+    """Retry a rejected batch number by number, one request at a time.
+
+    Callers hold one SMS_CONCURRENCY slot for the whole batch, so the retries must not
+    fan out beyond it.
+    """
+    return [await send_sms_to_number(number, message, api_key) for number, message in pairs]
+
+
+async def send_sms_to_numbers(numbers: List[str], message: str, api_key: str = None) -> List[Tuple[bool, str]]:
+    """Send the same SMS to several numbers in one provider request.
+
+    Returns one (success, info) per number. If the provider rejects the batch for a
+    reason other than an account-level error, the numbers are retried one by one so
+    every number gets its own outcome.
+    """
+    if len(numbers) == 1:
+        return [await send_sms_to_number(numbers[0], message, api_key)]
+
+    api_key = api_key or API_KEY
+    if not api_key or DRY_RUN:
+        return [(True, 'dry-run or no api key')] * len(numbers)
+
+    try:
+        ok, info = await _submit(','.join(numbers), message, api_key)
+    except Exception as e:
+        # Unknown whether anything was delivered, so do not retry
+        return [(False, str(e))] * len(numbers)
+
+    if ok or response_code(info) in ACCOUNT_ERROR_CODES:
+        return [(ok, info)] * len(numbers)
+    return await _send_each([(n, message) for n in numbers], api_key)
+
+
+async def send_sms_many(pairs: List[Tuple[str, str]], api_key: str = None) -> List[Tuple[bool, str]]:
+    """Send a different SMS to each number in one many-to-many provider request.
+
+    Returns one (success, info) per pair, retrying one by one on a rejected batch
+    like send_sms_to_numbers.
+    """
+    if len(pairs) == 1:
+        return [await send_sms_to_number(pairs[0][0], pairs[0][1], api_key)]
+
+    api_key = api_key or API_KEY
+    if not api_key or DRY_RUN:
+        return [(True, 'dry-run or no api key')] * len(pairs)
+
+    try:
+        ok, info = await _submit_many(pairs, api_key)
+    except Exception as e:
+        return [(False, str(e))] * len(pairs)
 
-    for n in numbers:
-        norm = normalize_phone(n)
-        if not norm or len(norm) < 11:
-            failed.append({'number': n, 'normalized': norm, 'reason': 'invalid_number'})
-            continue
+    if ok or response_code(info) in ACCOUNT_ERROR_CODES:
+        return [(ok, info)] * len(pairs)
+    return await _send_each(pairs, api_key)
 
-        ok, info = send_sms_to_number(norm, message)
-        if ok:
-            sent_count += 1
-            success.append({'number': n, 'normalized': norm, 'info': info})
+
+def _plan_recipients(numbers: List[str], outcomes: List[Dict[str, Any]], normalized=None, ok=None) -> List[Tuple[int, str, str]]:
+    """Normalize numbers (unless `normalized` and `ok` already hold the result), record
+    invalid ones in `outcomes` and return (idx, number, normalized) for the rest."""
+    if normalized is None:
+        normalized, ok = normalize_phones(numbers)
+        normalized, ok = normalized.tolist(), ok.tolist()
+    valid = []
+    for idx, (n, norm, is_valid) in enumerate(zip(numbers, normalized, ok)):
+        if not is_valid:
+            outcomes[idx] = {'ok': False, 'entry': {'number': n, 'normalized': norm, 'reason': 'invalid_number'}}
         else:
-            failed.append({'number': n, 'normalized': norm, 'info': info})
+            valid.append((idx, n, norm))
+    return valid
+
+
+async def _run_batches(valid: List[Tuple[int, str, str]], outcomes: List[Dict[str, Any]], batch_size: int, concurrency: int, submit):
+    """Split `valid` into batches, send them through `submit` concurrently and record outcomes by index."""
+    semaphore = asyncio.Semaphore(max(1, concurrency or SMS_CONCURRENCY))
+
+    async def send_batch(batch):
+        async with semaphore:
+            results = await submit(batch)
+        for (idx, n, norm), (ok, info) in zip(batch, results):
+            outcomes[idx] = {'ok': ok, 'entry': {'number': n, 'normalized': norm, 'info': info}}
+
+    await asyncio.gather(*(send_batch(valid[i:i + batch_size]) for i in range(0, len(valid), batch_size)))
+
+
+def _summarize(outcomes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    success = [o['entry'] for o in outcomes if o['ok']]
+    failed = [o['entry'] for o in outcomes if not o['ok']]
+    sent_count = len(success)
 
     return {
         'sent_count': sent_count,
@@ -89,3 +289,77 @@ def bulk_send(message: str, numbers: List[str]) -> Dict[str, Any]:
         'failed_recipients': failed,
         'message': f'Sent: {sent_count}, Failed: {len(failed)}'
     }
+
+
+def _dedupe(valid: List[Tuple[int, str, str]], key) -> Tuple[List[Tuple[int, str, str]], List[Tuple[Tuple[int, str, str], int]]]:
+    """Split recipients into the first occurrence of each key and (recipient, first index) duplicates."""
+    first_of = {}
+    unique = []
+    duplicates = []
+    for rec in valid:
+        k = key(rec)
+        if k in first_of:
+            duplicates.append((rec, first_of[k]))
+        else:
+            first_of[k] = rec[0]
+            unique.append(rec)
+    return unique, duplicates
+
+
+def _fan_out(duplicates: List[Tuple[Tuple[int, str, str], int]], outcomes: List[Dict[str, Any]]):
+    """Copy the outcome of each sent recipient to its duplicates."""
+    for (idx, n, norm), src in duplicates:
+        outcomes[idx] = {
+            'ok': outcomes[src]['ok'],
+            'entry': {'number': n, 'normalized': norm, 'info': outcomes[src]['entry']['info'], 'duplicate_of': src},
+        }
+
+
+async def bulk_send(message: str, numbers: List[str], concurrency: int = None, batch_size: int = None) -> Dict[str, Any]:
+    """Send message to multiple numbers. Returns dict with sent_count, failed_count, lists.
+
+    Valid numbers are packed into multi-recipient requests of up to `batch_size`
+    (default SMS_BATCH_SIZE). Up to `concurrency` (default SMS_CONCURRENCY) requests
+    are in flight at once; the shared rate limiter keeps the overall rate within the
+    provider quota. A number that appears more than once (after normalization) is sent
+    once; `duplicates_skipped` counts the sends saved. Recipient lists keep the input order.
+    """
+    outcomes: List[Dict[str, Any]] = [None] * len(numbers)
+    valid = _plan_recipients(numbers, outcomes)
+    unique, duplicates = _dedupe(valid, lambda rec: rec[2])
+
+    async def submit(batch):
+        return await send_sms_to_numbers([norm for _, _, norm in batch], message)
+
+    await _run_batches(unique, outcomes, max(1, batch_size or SMS_BATCH_SIZE), concurrency, submit)
+    _fan_out(duplicates, outcomes)
+    result = _summarize(outcomes)
+    result['duplicates_skipped'] = len(duplicates)
+    return result
+
+
+async def send_personalized(pairs: List[Tuple[str, str]], concurrency: int = None, batch_size: int = None,
+                            normalized: List[str] = None, valid: List[bool] = None) -> Dict[str, Any]:
+    """Send a different message to each number. `pairs` is a list of (number, message).
+
+    Pairs are packed into many-to-many requests of up to `batch_size` (default
+    SMS_MANY_BATCH_SIZE). Identical (normalized number, message) pairs are sent once.
+    Numbers already run through normalize_phones can pass its results as `normalized`
+    and `valid` (one per pair) to skip normalizing them again.
+    Returns the same dict as bulk_send; every recipient entry carries `index`, its
+    position in `pairs`, so callers can map outcomes back to rows.
+    """
+    outcomes: List[Dict[str, Any]] = [None] * len(pairs)
+    valid = _plan_recipients([number for number, _ in pairs], outcomes, normalized, valid)
+    unique, duplicates = _dedupe(valid, lambda rec: (rec[2], str(pairs[rec[0]][1])))
+
+    async def submit(batch):
+        return await send_sms_many([(norm, str(pairs[idx][1])) for idx, _, norm in batch])
+
+    await _run_batches(unique, outcomes, max(1, batch_size or SMS_MANY_BATCH_SIZE), concurrency, submit)
+    _fan_out(duplicates, outcomes)
+    for idx, o in enumerate(outcomes):
+        o['entry']['index'] = idx
+    result = _summarize(outcomes)
+    result['duplicates_skipped'] = len(duplicates)
+    return result
@@ -0,0 +1,209 @@
+import os
+import string
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from bson import ObjectId
+from pymongo import ReturnDocument
+from database import get_sms_templates_collection
+from templates import rank_scores, page_of
+from executors import run_cpu
+from content_cache import rendered_results, render_key
+
+SMS_TEMPLATE_CACHE_SIZE = int(os.getenv('SMS_TEMPLATE_CACHE_SIZE', 64))
+
+# Placeholders computed from the score column rather than read from a sheet column
+COMPUTED_FIELDS = {'position', 'highest'}
+
+# template id -> (version, CompiledTemplate); most recently used last
+_compiled = OrderedDict()
+
+
+def _parse(body: str) -> List[Tuple[str, Optional[str]]]:
+    """Split a template body into (literal text, placeholder or None) pieces."""
+    if not isinstance(body, str):
+        raise ValueError('Invalid template: body must be text')
+    parts = []
+    try:
+        for literal, field, spec, conversion in string.Formatter().parse(body):
+            if field is not None and (spec or conversion):
+                raise ValueError(f'Format specs are not supported: {{{field}}}')
+            if field == '':
+                raise ValueError('Empty placeholder {}')
+            parts.append((literal, field))
+    except ValueError as e:
+        raise ValueError(f'Invalid template: {e}')
+    return parts
+
+
+def _column_text(col: pd.Series) -> pd.Series:
+    """Cell text for a placeholder: blanks for missing values, whole floats without '.0'."""
+    if pd.api.types.is_float_dtype(col) and (col.dropna() % 1 == 0).all():
+        col = col.astype('Int64')
+    return col.astype('string').fillna('').astype(object)
+
+
+class CompiledTemplate:
+    """A template body parsed once and rendered column-wise over a whole sheet.
+
+    Placeholders are sheet column names ({Name}, {Roll}) or computed fields:
+    {position} (rank by score_column, 1 = highest) and {highest} (top score).
+    Rows whose score is missing or 0 are rendered with absent_body when given.
+    """
+
+    def __init__(self, body: str, absent_body: Optional[str] = None, score_column: Optional[str] = None):
+        self.parts = _parse(body)
+        self.absent_parts = _parse(absent_body) if absent_body else None
+        self.score_column = score_column
+        fields = {f for _, f in self.parts + (self.absent_parts or []) if f}
+        if (fields & COMPUTED_FIELDS or self.absent_parts) and not score_column:
+            raise ValueError('score_column is required for {position}, {highest} and absent_body')
+
+    @staticmethod
+    def _fill(parts, text, n: int) -> np.ndarray:
+        out = np.full(n, '', dtype=object)
+        for literal, field in parts:
+            if literal:
+                out = out + literal
+            if field is not None:
+                out = out + text(field)
+        return out
+
+    def render(self, df: pd.DataFrame, group_by: Optional[List[str]] = None) -> pd.DataFrame:
+        """Add Result (and Position when a score column is set) to df.
+
+        With group_by, {position} and {highest} are computed per group.
+        """
+        highest = rank_scores(df, self.score_column, group_by) if self.score_column else None
+        return self.render_ranked(df, highest)
+
+    def render_ranked(self, df: pd.DataFrame, highest) -> pd.DataFrame:
+        """Add Result to rows already ranked (numeric score column, Position set)."""
+        values = {}
+        absent = None
+        if self.score_column:
+            if self.score_column in df.columns:
+                scores = pd.to_numeric(df[self.score_column], errors='coerce')
+            else:
+                scores = pd.Series(np.nan, index=df.index)
+            values['position'] = _column_text(df['Position']).to_numpy()
+            values['highest'] = highest.astype(str).to_numpy() if isinstance(highest, pd.Series) else str(highest)
+            absent = (scores.isna() | (scores == 0)).to_numpy()
+
+        def text(field):
+            # Each column is converted once even if it appears in both bodies
+            if field not in values:
+                values[field] = _column_text(df[field]).to_numpy() if field in df.columns else ''
+            return values[field]
+
+        result = self._fill(self.parts, text, len(df))
+        if self.absent_parts is not None and absent.any():
+            result = np.where(absent, self._fill(self.absent_parts, text, len(df)), result)
+        df['Result'] = pd.Series(result, index=df.index, dtype=object)
+        return df
+
+
+def compile_template(doc: Dict[str, Any]) -> CompiledTemplate:
+    return CompiledTemplate(doc['body'], doc.get('absent_body'), doc.get('score_column'))
+
+
+def compiled_for(doc: Dict[str, Any]) -> CompiledTemplate:
+    """Compiled renderer for a stored template, parsed only when its version changes."""
+    key = str(doc['_id'])
+    hit = _compiled.get(key)
+    if hit is not None and hit[0] == doc.get('version'):
+        _compiled.move_to_end(key)
+        return hit[1]
+    compiled = compile_template(doc)
+    _compiled[key] = (doc.get('version'), compiled)
+    _compiled.move_to_end(key)
+    while len(_compiled) > SMS_TEMPLATE_CACHE_SIZE:
+        _compiled.popitem(last=False)
+    return compiled
+
+
+def invalidate(template_id: str):
+    _compiled.pop(str(template_id), None)
+
+
+def _public(doc: Dict[str, Any]) -> Dict[str, Any]:
+    doc = dict(doc)
+    doc['id'] = str(doc.pop('_id'))
+    return doc
+
+
+async def list_templates() -> List[Dict[str, Any]]:
+    templates = await get_sms_templates_collection()
+    return [_public(doc) async for doc in templates.find().sort('name', 1)]
+
+
+async def get_template(template_id: str) -> Optional[Dict[str, Any]]:
+    if not ObjectId.is_valid(template_id):
+        return None
+    templates = await get_sms_templates_collection()
+    return await templates.find_one({'_id': ObjectId(template_id)})
+
+
+async def create_template(fields: Dict[str, Any], user_id: str) -> Dict[str, Any]:
+    """Store a new template. Raises ValueError if it does not compile."""
+    compile_template(fields)
+    templates = await get_sms_templates_collection()
+    now = datetime.utcnow()
+    doc = {**fields, 'version': 1, 'created_by': user_id, 'created_at': now, 'updated_at': now}
+    result = await templates.insert_one(doc)
+    doc['_id'] = result.inserted_id
+    compiled_for(doc)
+    return _public(doc)
+
+
+async def update_template(template_id: str, changes: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Apply changes and bump the version. Raises ValueError if the result does not compile."""
+    doc = await get_template(template_id)
+    if doc is None:
+        return None
+    compile_template({**doc, **changes})
+    templates = await get_sms_templates_collection()
+    doc = await templates.find_one_and_update(
+        {'_id': doc['_id']},
+        {'$set': {**changes, 'updated_at': datetime.utcnow()}, '$inc': {'version': 1}},
+        return_document=ReturnDocument.AFTER,
+    )
+    invalidate(template_id)
+    return _public(doc)
+
+
+async def delete_template(template_id: str) -> bool:
+    if not ObjectId.is_valid(template_id):
+        return False
+    templates = await get_sms_templates_collection()
+    result = await templates.delete_one({'_id': ObjectId(template_id)})
+    invalidate(template_id)
+    return result.deleted_count > 0
+
+
+async def render_template(template_id: str, df: pd.DataFrame, group_by: Optional[List[str]] = None, rows=None,
+                          source: Optional[str] = None) -> Optional[pd.DataFrame]:
+    """Render a stored template over df, or None if the template does not exist.
+
+    With rows (positions), ranking still covers all of df but only those rows are rendered and returned.
+    source (a content hash of df) caches the result for this template version.
+    """
+    doc = await get_template(template_id)
+    if doc is None:
+        return None
+    key = render_key(source, (template_id, doc.get('version')), group_by, rows) if source else None
+    out = rendered_results.get(key) if key else None
+    if out is None:
+        out = await run_cpu(_render, compiled_for(doc), df, group_by, rows)
+        if key:
+            rendered_results.put(key, out)
+    return out
+
+
+def _render(compiled: CompiledTemplate, df: pd.DataFrame, group_by, rows) -> pd.DataFrame:
+    if rows is None:
+        return compiled.render(df, group_by)
+    highest = rank_scores(df, compiled.score_column, group_by) if compiled.score_column else None
+    return compiled.render_ranked(*page_of(df, highest, rows))
@@ -1,99 +1,177 @@
+import numpy as np
 import pandas as pd
+from typing import List, Optional
 
+SIGNATURE = "— Big Bang Exam Care"
 
-def format_varsity_results(df: pd.DataFrame) -> pd.DataFrame:
-    # Follow user's desired logic: compute highest_total and position (1 = highest)
-    if 'Total' in df.columns:
-        # Safely coerce to numeric where possible
-        try:
-            df['Total'] = pd.to_numeric(df['Total'], errors='coerce')
-        except Exception:
-            pass
-        highest_total = int(df['Total'].max()) if not df['Total'].isna().all() else 0
-        # Compute position: rank descending, method='min'
-        try:
-            df['Position'] = df['Total'].rank(ascending=False, method='min').astype('Int64')
-        except Exception:
-            df['Position'] = None
+
+class _RowText:
+    """Column-wise cell text of a non-empty frame for building messages.
+
+    Cells are taken from `df.to_numpy()`, so each is printed the way it reads in
+    its row: ints in a mixed row stay ints, floats keep their '.0'. When the rows
+    have a nullable common dtype (an all-numeric sheet plus the Int64 Position
+    column) they are read as that dtype. A repeated header reads its first column.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.index = df.index
+        self.positions = {}
+        for i, c in enumerate(df.columns):
+            self.positions.setdefault(c, i)
+        row_dtype = df.iloc[0].dtype
+        if isinstance(row_dtype, pd.api.extensions.ExtensionDtype):
+            df = df.astype(row_dtype)
+        self.values = df.to_numpy(dtype=object)
+
+    def raw(self, col):
+        i = self.positions.get(col)
+        return None if i is None else self.values[:, i]
+
+    def text(self, col, default=''):
+        """str() of every cell of a column, or `default` when the column is missing."""
+        col_values = self.raw(col)
+        if col_values is None:
+            return default
+        return pd.Series(col_values, index=self.index, dtype=object).astype(str)
+
+    def absent(self, col) -> np.ndarray:
+        """Mask of rows where `pd.isna(value) or value == 0`; every row when the column is missing."""
+        col_values = self.raw(col)
+        if col_values is None:
+            return np.ones(len(self.index), dtype=bool)
+        mask = np.asarray(pd.isna(col_values), dtype=bool)
+        present = ~mask
+        mask[present] = np.asarray(col_values[present] == 0, dtype=bool)
+        return mask
+
+    def position(self):
+        """Position cell text; None becomes ''."""
+        col_values = self.raw('Position')
+        if col_values is None:
+            return ''
+        text = self.text('Position')
+        return text.mask(np.equal(col_values, None).astype(bool), '')
+
+
+def rank_scores(df: pd.DataFrame, score_col: str, group_by: Optional[List[str]] = None):
+    """Coerce df[score_col] to numbers and add Position (rank descending, method='min').
+
+    Returns the highest score as an int. With group_by, Position and the highest
+    score are computed per group in one groupby pass and the highest score is
+    returned as an int Series aligned with df.
+    """
+    if group_by:
+        missing = [c for c in group_by if c not in df.columns]
+        if missing:
+            raise ValueError(f"Group column(s) not found: {', '.join(missing)}")
+    if score_col not in df.columns:
+        df['Position'] = None
+        return 0
+
+    # Safely coerce to numeric where possible
+    try:
+        df[score_col] = pd.to_numeric(df[score_col], errors='coerce')
+    except Exception:
+        pass
+    scores = df[score_col]
+    if group_by:
+        groups = scores.groupby([df[c] for c in group_by], dropna=False, sort=False)
+        highest = np.trunc(groups.transform('max').fillna(0)).astype('int64')
+        ranks = lambda: groups.rank(ascending=False, method='min')
     else:
-        highest_total = 0
+        highest = int(scores.max()) if not scores.isna().all() else 0
+        ranks = lambda: scores.rank(ascending=False, method='min')
+    try:
+        df['Position'] = ranks().astype('Int64')
+    except Exception:
         df['Position'] = None
+    return highest
+
+
+def page_of(df: pd.DataFrame, highest, rows):
+    """Rows at the given positions of a ranked frame, with their highest scores."""
+    page = df.iloc[rows].copy()
+    return page, highest.iloc[rows] if isinstance(highest, pd.Series) else highest
+
+
+def _highest_text(highest):
+    return highest.astype(str) if isinstance(highest, pd.Series) else str(highest)
 
-    def format_result(row):
-        # Mirror the user's format_result for Varsity/Engineering
-        try:
-            total = row.get('Total')
-            exam = row.get('Exam', '')
-            name = row.get('Name', '')
-            roll = row.get('Roll', '')
-            if pd.isna(total) or total == 0:
-                return (
-                    f"ফলাফল: {exam}\n"
-                    f"Name: {name}, Roll: {roll}, Absent, "
-                    f"Highest Marks: {highest_total}.\n"
-                    f"— Big Bang Exam Care"
-                )
-            else:
-                mcq = row.get('MCQ', '')
-                written = row.get('Written', '')
-                position = row.get('Position') if row.get('Position') is not None else ''
-                return (
-                    f"ফলাফল: {exam}\n"
-                    f"Name: {name}, Roll: {roll}, "
-                    f"MCQ: {mcq}., Written: {written}., "
-                    f"Total: {total}., Position: {position}, "
-                    f"Highest Marks: {highest_total}.\n"
-                    f"— Big Bang Exam Care"
-                )
-        except Exception:
-            return ''
 
-    df['Result'] = df.apply(format_result, axis=1)
+def _pick(absent: np.ndarray, when_absent: pd.Series, when_present: pd.Series, index) -> pd.Series:
+    return pd.Series(np.where(absent, when_absent, when_present), index=index, dtype=object)
+
+
+def format_varsity_results(df: pd.DataFrame, group_by: Optional[List[str]] = None) -> pd.DataFrame:
+    # Follow user's desired logic: compute highest_total and position (1 = highest),
+    # per group of the group_by columns (batch, center...) when given
+    highest_total = rank_scores(df, 'Total', group_by)
+    return render_varsity_results(df, highest_total)
+
+
+def render_varsity_results(df: pd.DataFrame, highest_total) -> pd.DataFrame:
+    """Build the Result column of rows already ranked (numeric Total, Position set)."""
+
+    def render(rows):
+        exam, name, roll = rows.text('Exam'), rows.text('Name'), rows.text('Roll')
+        head = "ফলাফল: " + exam + "\nName: " + name + ", Roll: " + roll + ", "
+        tail = "Highest Marks: " + _highest_text(highest_total) + ".\n" + SIGNATURE
+        when_absent = head + "Absent, " + tail
+        when_present = (
+            head
+            + "MCQ: " + rows.text('MCQ') + "., Written: " + rows.text('Written') + "., "
+            + "Total: " + rows.text('Total') + "., Position: " + rows.position() + ", "
+            + tail
+        )
+        return _pick(rows.absent('Total'), when_absent, when_present, rows.index)
+
+    df['Result'] = _render(df, render)
     return df
 
 
-def format_medical_results(df: pd.DataFrame) -> pd.DataFrame:
+def format_medical_results(df: pd.DataFrame, group_by: Optional[List[str]] = None) -> pd.DataFrame:
     # Follow user's desired medical result logic
-    if 'Marks' in df.columns:
-        try:
-            df['Marks'] = pd.to_numeric(df['Marks'], errors='coerce')
-        except Exception:
-            pass
-        highest_marks = int(df['Marks'].max()) if not df['Marks'].isna().all() else 0
-        # Position: rank descending (1 = highest)
-        try:
-            df['Position'] = df['Marks'].rank(ascending=False, method='min').astype('Int64')
-        except Exception:
-            df['Position'] = None
-    else:
-        highest_marks = 0
-        df['Position'] = None
+    highest_marks = rank_scores(df, 'Marks', group_by)
+    return render_medical_results(df, highest_marks)
 
-    def format_result(row):
-        try:
-            marks = row.get('Marks')
-            exam = row.get('Exam', '')
-            name = row.get('Name', '')
-            roll = row.get('Roll', '')
-            if pd.isna(marks) or marks == 0:
-                return (
-                    f"ফলাফল: {exam}\n"
-                    f"Name: {name}, Roll: {roll}, Absent, "
-                    f"Highest Marks: {highest_marks}. \n"
-                    f"— Big Bang Exam Care"
-                )
-            else:
-                position = row.get('Position') if row.get('Position') is not None else ''
-                return (
-                    f"ফলাফল: {exam}\n"
-                    f"Name: {name}, Roll: {roll}, "
-                    f"Obtained Marks: {marks}, "
-                    f"Position: {position}, "
-                    f"Highest Marks: {highest_marks}. \n"
-                    f"— Big Bang Exam Care"
-                )
-        except Exception:
-            return ''
 
-    df['Result'] = df.apply(format_result, axis=1)
+def render_medical_results(df: pd.DataFrame, highest_marks) -> pd.DataFrame:
+    """Build the Result column of rows already ranked (numeric Marks, Position set)."""
+
+    def render(rows):
+        exam, name, roll = rows.text('Exam'), rows.text('Name'), rows.text('Roll')
+        head = "ফলাফল: " + exam + "\nName: " + name + ", Roll: " + roll + ", "
+        tail = "Highest Marks: " + _highest_text(highest_marks) + ". \n" + SIGNATURE
+        when_absent = head + "Absent, " + tail
+        when_present = (
+            head
+            + "Obtained Marks: " + rows.text('Marks') + ", "
+            + "Position: " + rows.position() + ", "
+            + tail
+        )
+        return _pick(rows.absent('Marks'), when_absent, when_present, rows.index)
+
+    df['Result'] = _render(df, render)
     return df
+
+
+def _render(df: pd.DataFrame, render) -> pd.Series:
+    """Build the Result column column-wise; an empty frame gets an empty column."""
+    if not len(df):
+        return pd.Series(index=df.index, dtype=object)
+    return render(_RowText(df))
+
+
+# Built-in layouts: type -> (score column, ranking formatter, renderer for pre-ranked rows)
+LAYOUTS = {
+    'varsity': ('Total', format_varsity_results, render_varsity_results),
+    'medical': ('Marks', format_medical_results, render_medical_results),
+}
+
+
+def format_page(ttype: str, df: pd.DataFrame, rows, group_by: Optional[List[str]] = None) -> pd.DataFrame:
+    """Rank a built-in layout over all of df but render only the rows at the given positions."""
+    score_col, _, render = LAYOUTS[ttype]
+    highest = rank_scores(df, score_col, group_by)
+    return render(*page_of(df, highest, rows))
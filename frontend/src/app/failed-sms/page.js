@@ -1,6 +1,6 @@
 'use client';
 
-import { useEffect, useState, useCallback } from 'react';
+import { useEffect, useState, useCallback, useRef } from 'react';
 import { useRouter } from 'next/navigation';
 
 const API_BASE_URL = process.env.NEXT_PUBLIC_API_URL || 'https://sms-8kiu.onrender.com';
@@ -9,7 +9,13 @@ export default function FailedSMSPage(){
   const [items, setItems] = useState([]);
   const [selected, setSelected] = useState(new Set());
   const [loading, setLoading] = useState(false);
+  // Cursor for the next page (null when there are no more) and the filtered total
+  const [next, setNext] = useState(null);
+  const [total, setTotal] = useState(null);
+  const [filters, setFilters] = useState({ resolved: '', number: '', since: '', until: '' });
   const router = useRouter();
+  // Id of the latest request; responses to older ones are dropped
+  const requestId = useRef(0);
 
   useEffect(()=>{
     const checkAuth = async ()=>{
@@ -26,19 +32,35 @@ export default function FailedSMSPage(){
   const token = typeof window !== 'undefined' ? localStorage.getItem('token') : null;
   const backToHome = ()=> router.push('/');
 
-  const fetchItems = useCallback(async ()=>{
+  // First page with the current filters, or the page after `after` appended to the list
+  const fetchItems = useCallback(async (after = null)=>{
+    const id = ++requestId.current;
     setLoading(true);
+    const params = new URLSearchParams({ limit: '50' });
+    Object.entries(filters).forEach(([k, v])=>{ if(v) params.set(k, v) });
+    if(after) params.set('after', after);
     try{
-      const res = await fetch(`${API_BASE_URL}/failed-sms`,{headers:{'Authorization':`Bearer ${token}`}});
+      const res = await fetch(`${API_BASE_URL}/failed-sms?${params}`,{headers:{'Authorization':`Bearer ${token}`}});
       const j = await res.json();
-      setItems(j);
+      if(id !== requestId.current) return;
+      if(!res.ok) throw new Error(j.detail);
+      setItems(prev => after ? [...prev, ...j.items] : j.items);
+      setNext(j.next);
+      // Only the first page carries the total
+      if(!after) setTotal(j.total_capped ? `${j.total}+` : j.total);
     }catch(e){
-      setItems([]);
+      if(id !== requestId.current) return;
+      if(!after) setItems([]);
+      setNext(null);
     }
     setLoading(false);
-  }, [token])
+  }, [token, filters])
 
-  useEffect(()=>{ fetchItems() },[fetchItems])
+  // Refetch once typing in the filters pauses rather than on every keystroke
+  useEffect(()=>{
+    const timer = setTimeout(()=>fetchItems(), 300);
+    return ()=>clearTimeout(timer);
+  },[fetchItems])
 
   const toggle = (id)=>{
     const s = new Set(selected);
@@ -72,9 +94,31 @@ export default function FailedSMSPage(){
         <h3 className="mb-0">Failed SMS Management</h3>
       </div>
       <div className="card p-3">
+        <div className="row g-2 mb-3">
+          <div className="col-md-3">
+            <input className="form-control form-control-sm" placeholder="Number starts with" value={filters.number}
+              onChange={e=>setFilters({...filters, number: e.target.value})} />
+          </div>
+          <div className="col-md-2">
+            <select className="form-select form-select-sm" value={filters.resolved} onChange={e=>setFilters({...filters, resolved: e.target.value})}>
+              <option value="">All</option>
+              <option value="false">Unresolved</option>
+              <option value="true">Resolved</option>
+            </select>
+          </div>
+          <div className="col-md-3">
+            <input type="date" className="form-control form-control-sm" title="From" value={filters.since}
+              onChange={e=>setFilters({...filters, since: e.target.value})} />
+          </div>
+          <div className="col-md-3">
+            <input type="date" className="form-control form-control-sm" title="Before" value={filters.until}
+              onChange={e=>setFilters({...filters, until: e.target.value})} />
+          </div>
+        </div>
         <div className="mb-3">
-          <button className="btn btn-primary me-2" onClick={fetchItems} disabled={loading}>{loading? 'Loading...' : 'Refresh'}</button>
+          <button className="btn btn-primary me-2" onClick={()=>fetchItems()} disabled={loading}>{loading? 'Loading...' : 'Refresh'}</button>
           <button className="btn btn-success" onClick={resendSelected} disabled={loading}>{loading? 'Working...' : 'Resend Selected'}</button>
+          {total !== null && <span className="ms-3 text-muted">Showing {items.length} of {total}</span>}
         </div>
 
         <div style={{maxHeight:400, overflow:'auto'}}>
@@ -95,6 +139,9 @@ export default function FailedSMSPage(){
             </tbody>
           </table>
         </div>
+        {next && (
+          <button className="btn btn-outline-secondary btn-sm mt-2" onClick={()=>fetchItems(next)} disabled={loading}>{loading? 'Loading...' : 'Load more'}</button>
+        )}
       </div>
     </div>
   )
@@ -17,6 +17,7 @@ export default function Home() {
   const [showUpload, setShowUpload] = useState(false);
   const [activeOption, setActiveOption] = useState(null);
   const [data, setData] = useState([]);
+  const [datasetId, setDatasetId] = useState(null); // server-side copy of the uploaded sheet
   const [selectedIndices, setSelectedIndices] = useState([]);
   const [smsMessage, setSmsMessage] = useState(''); // Separate state for SMS results
   const [currentUser, setCurrentUser] = useState(null);
@@ -38,6 +39,7 @@ export default function Home() {
         const parsed = JSON.parse(imported);
         if (parsed && Array.isArray(parsed.data) && parsed.data.length > 0) {
           setData(parsed.data);
+          setDatasetId(null);
           setActiveOption('upload');
           setShowUpload(true);
           // auto-select all
@@ -118,6 +120,7 @@ export default function Home() {
       const result = await response.json();
       if (response.ok) {
         setData(result.data);
+        setDatasetId(result.dataset_id || null);
         // Auto-select all rows by default
         setSelectedIndices(result.data.map((_, index) => index));
         setMessage('');
@@ -148,6 +151,26 @@ export default function Home() {
     }
   };
 
+  // POST to an endpoint that accepts a stored dataset; if the server no longer has it
+  // (expired or dropped), post the rows this page still holds instead
+  const postRows = async (path, datasetBody, rowsBody) => {
+    const token = localStorage.getItem('token');
+    const post = (body) => fetch(`${API_BASE_URL}${path}`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Authorization': `Bearer ${token}`,
+      },
+      body: JSON.stringify(body),
+    });
+    if (datasetId) {
+      const response = await post(datasetBody);
+      if (response.status !== 404) return response;
+      setDatasetId(null);
+    }
+    return post(rowsBody);
+  };
+
   const handleSendSMS = async () => {
     if (selectedIndices.length === 0) {
       setMessage('Please select at least one row to send SMS');
@@ -157,19 +180,33 @@ export default function Home() {
     setLoading(true);
     const token = localStorage.getItem('token');
     try {
-      const response = await fetch(`${API_BASE_URL}/send-sms`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${token}`,
-        },
-        body: JSON.stringify({
-          data: data,
-          selectedIndices: selectedIndices
-        }),
+      // Refer to the stored upload instead of posting every row back
+      const response = await postRows('/send-sms', {
+        dataset_id: datasetId,
+        rows: selectedIndices
+      }, {
+        data: data,
+        selectedIndices: selectedIndices
       });
-      const result = await response.json();
-      setSmsMessage(result.message); // Set SMS result message
+      let result = await response.json();
+      if (!response.ok) {
+        setMessage(result.detail || 'Error sending SMS');
+        setSmsResult(null);
+        setSmsMessage('');
+        setLoading(false);
+        return;
+      }
+      setSmsMessage(result.message);
+      // Sending runs as a background job on the server; poll until it finishes
+      while (result.job_id && !['completed', 'failed'].includes(result.status)) {
+        await new Promise(resolve => setTimeout(resolve, 2000));
+        const jobResponse = await fetch(`${API_BASE_URL}/jobs/${result.job_id}`, {
+          headers: { 'Authorization': `Bearer ${token}` },
+        });
+        if (!jobResponse.ok) break;
+        result = await jobResponse.json();
+        setSmsMessage(result.message); // Live sent/failed/pending counts
+      }
       setSmsResult(result); // Store the full result including failed_recipients
       setMessage(''); // Clear any previous error messages
     } catch (error) {
@@ -187,17 +224,11 @@ export default function Home() {
     }
 
     setLoading(true);
-    const token = localStorage.getItem('token');
     try {
-      const response = await fetch(`${API_BASE_URL}/export-excel`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${token}`,
-        },
-        body: JSON.stringify({
-          data: data
-        }),
+      const response = await postRows('/export-excel', {
+        dataset_id: datasetId
+      }, {
+        data: data
       });
 
       if (response.ok) {
@@ -509,12 +540,13 @@ export default function Home() {
                   <div className="mt-3 card shadow p-3">
                     <p><b>Send SMS with Excel file</b></p>
                     <div className="mb-3">
-                      <input type="file" accept=".xlsx,.xls" onChange={handleFileChange} className="form-control" />
+                      <input type="file" accept=".xlsx,.xls,.csv,.parquet" onChange={handleFileChange} className="form-control" />
                     </div>
                     <div className="d-flex gap-2">
                       <button onClick={handleUpload} disabled={!file || loading} className="btn btn-primary">{loading ? 'Uploading...' : 'Upload and Parse'}</button>
                       <button onClick={() => { 
                         setData([]); 
+                        setDatasetId(null);
                         setSelectedIndices([]); 
                         setActiveOption('upload'); 
                         router.push(pathname);  }} className="btn btn-outline-secondary">Discard</button>
@@ -10,9 +10,12 @@ export default function TemplatesPage() {
   const [type, setType] = useState("varsity");
   const [excelFile, setExcelFile] = useState(null);
   const [parsedRows, setParsedRows] = useState([]);
+  const [datasetId, setDatasetId] = useState(null);
   const [preview, setPreview] = useState(null);
   const [selectedIndices, setSelectedIndices] = useState([]);
   const [loading, setLoading] = useState(false);
+  const [customTemplates, setCustomTemplates] = useState([]);
+  const [groupBy, setGroupBy] = useState(""); // comma-separated columns, e.g. "Batch, Center"
   const router = useRouter();
 
   useEffect(() => {
@@ -27,6 +30,14 @@ export default function TemplatesPage() {
           localStorage.removeItem("token");
           return router.push("/login");
         }
+        // Stored templates are offered next to the built-in layouts
+        const tpl = await fetch(`${API_BASE_URL}/sms-templates`, {
+          headers: { Authorization: `Bearer ${token}` },
+        });
+        if (tpl.ok) {
+          const j = await tpl.json();
+          setCustomTemplates(j.templates || []);
+        }
       } catch (e) {
         localStorage.removeItem("token");
         return router.push("/login");
@@ -38,6 +49,8 @@ export default function TemplatesPage() {
   const token =
     typeof window !== "undefined" ? localStorage.getItem("token") : null;
   const backToHome = () => router.push("/");
+  const groupColumns = () =>
+    groupBy.split(",").map((c) => c.trim()).filter(Boolean);
 
   const doPreview = async () => {
     if (!excelFile) {
@@ -62,6 +75,7 @@ export default function TemplatesPage() {
       const parsed = await up.json();
       const data = parsed.data || [];
       setParsedRows(data);
+      setDatasetId(parsed.dataset_id || null);
       // default to selecting all rows after preview
       setSelectedIndices(data.map((_, i) => i));
 
@@ -71,7 +85,10 @@ export default function TemplatesPage() {
           "Content-Type": "application/json",
           Authorization: `Bearer ${token}`,
         },
-        body: JSON.stringify({ type, data }),
+        body: JSON.stringify({
+          ...(parsed.dataset_id ? { type, dataset_id: parsed.dataset_id } : { type, data }),
+          group_by: groupColumns(),
+        }),
       });
       const j = await res.json();
       // preview is now full rows including 'Result'
@@ -137,14 +154,24 @@ export default function TemplatesPage() {
       return;
     }
     setLoading(true);
-    const res = await fetch(`${API_BASE_URL}/templates/download`, {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        Authorization: `Bearer ${token}`,
-      },
-      body: JSON.stringify({ type, data }),
-    });
+    const download = (rows) =>
+      fetch(`${API_BASE_URL}/templates/download`, {
+        method: "POST",
+        headers: {
+          "Content-Type": "application/json",
+          Authorization: `Bearer ${token}`,
+        },
+        body: JSON.stringify({
+          ...(rows ? { type, data: rows } : { type, dataset_id: datasetId }),
+          group_by: groupColumns(),
+        }),
+      });
+    let res = await download(datasetId ? null : data);
+    if (datasetId && res.status === 404) {
+      // The server dropped the stored sheet; send the uploaded rows instead
+      setDatasetId(null);
+      res = await download(parsedRows);
+    }
     if (res.ok) {
       const blob = await res.blob();
       const url = window.URL.createObjectURL(blob);
@@ -159,7 +186,8 @@ export default function TemplatesPage() {
       window.URL.revokeObjectURL(url);
       document.body.removeChild(a);
     } else {
-      alert("Failed to download");
+      const j = await res.json().catch(() => ({}));
+      alert("Failed to download" + (j.detail ? ": " + j.detail : ""));
     }
     setLoading(false);
   };
@@ -193,14 +221,29 @@ export default function TemplatesPage() {
           >
             <option value="varsity">Varsity / Engineering Result</option>
             <option value="medical">Medical Result</option>
+            {customTemplates.map((t) => (
+              <option key={t.id} value={t.id}>
+                {t.name}
+              </option>
+            ))}
           </select>
         </div>
+        <div className="mb-3">
+          <label className="form-label">Rank within groups (optional)</label>
+          <input
+            type="text"
+            className="form-control"
+            placeholder="e.g. Batch, Center"
+            value={groupBy}
+            onChange={(e) => setGroupBy(e.target.value)}
+          />
+        </div>
 
         <div className="mb-3">
           <label className="form-label">Upload Excel (required)</label>
           <input
             type="file"
-            accept=".xlsx,.xls"
+            accept=".xlsx,.xls,.csv,.parquet"
             className="form-control mb-2"
             onChange={(e) => setExcelFile(e.target.files?.[0] ?? null)}
           />